@@ -0,0 +1,82 @@
+''' Checks EndogDbfWriter output is byte-for-byte identical to dbfpy and compares their records/sec '''
+import datetime
+import os
+import random
+import sys
+import tempfile
+import timeit
+from collections import namedtuple
+from contextlib import closing
+
+__author__ = 'adamj'
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'pedigrees'))
+
+from dbfpy import dbf
+from dbfwriter import EndogDbfWriter, ENDOG_FIELDS
+
+Row = namedtuple('Row', 'id sire_id dam_id birth_date sex group base_population_member')
+
+def synthetic_rows(count, seed=1):
+    ''' Returns count rows covering missing parents, missing birth dates and negative groups '''
+    generator = random.Random(seed)
+    rows = []
+    for i in range(count):
+        year = generator.randint(1979, 2012)
+        rows.append(Row(id=(year - 1900) * 100000 + i,
+                        sire_id=generator.choice([None, generator.randint(7900000, 11299999)]),
+                        dam_id=generator.choice([None, generator.randint(7900000, 11299999)]),
+                        birth_date=generator.choice([None, datetime.date(year, generator.randint(1, 12), generator.randint(1, 28))]),
+                        sex=generator.choice([1, 2]),
+                        group=generator.choice([-1, 0, 1, 2, 3, 5]),
+                        base_population_member=generator.random() < 0.1))
+    return rows
+
+def write_with_dbfpy(rows, output_file):
+    ''' The per-record dbfpy writer generate_endog_input used originally '''
+    with closing(dbf.Dbf(output_file, new=True)) as db:
+        db.addField(*ENDOG_FIELDS)
+        for animal in rows:
+            record = db.newRecord()
+            record['ID'] = animal.id if animal.id else 0
+            record['SIRE_ID'] = animal.sire_id if animal.sire_id else 0
+            record['DAM_ID'] = animal.dam_id if animal.dam_id else 0
+            record['BIRTH_DATE'] = animal.birth_date
+            record['S'] = animal.sex
+            record['GROUP'] = animal.group
+            record['REFERENCE'] = int(animal.base_population_member)
+            record.store()
+
+def write_with_endog_writer(rows, output_file):
+    writer = EndogDbfWriter(output_file)
+    for animal in rows:
+        writer.write(animal.id, animal.sire_id, animal.dam_id, animal.birth_date, animal.sex, animal.group,
+                     int(animal.base_population_member))
+    writer.close()
+
+def timed(function, rows, output_file):
+    start = timeit.default_timer()
+    function(rows, output_file)
+    return timeit.default_timer() - start
+
+def main(count=100000):
+    directory = tempfile.mkdtemp()
+    expected_file = os.path.join(directory, 'dbfpy.dbf')
+    actual_file = os.path.join(directory, 'writer.dbf')
+    for size in (0, 1, 8193):
+        rows = synthetic_rows(size)
+        write_with_dbfpy(rows, expected_file)
+        write_with_endog_writer(rows, actual_file)
+        if open(expected_file, 'rb').read() != open(actual_file, 'rb').read():
+            raise AssertionError('EndogDbfWriter output differs from dbfpy for %d rows' % size)
+    rows = synthetic_rows(count)
+    before = timed(write_with_dbfpy, rows, expected_file)
+    after = timed(write_with_endog_writer, rows, actual_file)
+    if open(expected_file, 'rb').read() != open(actual_file, 'rb').read():
+        raise AssertionError('EndogDbfWriter output differs from dbfpy for %d rows' % count)
+    print('Output identical to dbfpy for %d records' % count)
+    print('dbfpy: %.0f records/s  EndogDbfWriter: %.0f records/s  speedup: %.1fx' % (count / before, count / after, before / after))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
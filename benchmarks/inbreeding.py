@@ -0,0 +1,48 @@
+''' Times compute_inbreeding's ordering and indirect-method pass on a synthetic pedigree '''
+import os
+import random
+import sys
+import timeit
+
+__author__ = 'adamj'
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'pedigrees'))
+
+from graph import PedigreeGraph
+from inbreeding import inbreeding_coefficients
+
+def synthetic_rows(count, generations=20, sires_per_generation=0.01, unknown_parent_rate=0.05, seed=1):
+    ''' Yields graph rows for a closed population with heavily reused sires and overlapping generations '''
+    generator = random.Random(seed)
+    size = count // generations
+    males = []
+    females = []
+    for generation in range(generations):
+        sire_pool = generator.sample(males, max(1, int(size * sires_per_generation))) if males else []
+        new_males = []
+        new_females = []
+        for i in range(size):
+            animal_id = generation * size + i + 1
+            sire_id = generator.choice(sire_pool) if sire_pool and generator.random() > unknown_parent_rate else None
+            dam_id = generator.choice(females) if females and generator.random() > unknown_parent_rate else None
+            sex = generator.choice((1, 2))
+            (new_males if sex == 1 else new_females).append(animal_id)
+            yield (animal_id, sire_id, dam_id, sex, generation, None, False, False)
+        # Parents come from the last three generations
+        males = (males + new_males)[-3 * len(new_males):]
+        females = (females + new_females)[-3 * len(new_females):]
+
+def main(count=1000000):
+    start = timeit.default_timer()
+    graph = PedigreeGraph.from_rows(synthetic_rows(count))
+    loaded = timeit.default_timer()
+    order, generations = graph.topological_order()
+    ordered = timeit.default_timer()
+    coefficients = inbreeding_coefficients(order, graph.sires, graph.dams, generations)
+    computed = timeit.default_timer()
+    print('Animals: %d  inbred: %d  mean F: %.6f  max F: %.6f' % (len(graph), (coefficients > 0).sum(), coefficients.mean(), coefficients.max()))
+    print('graph build: %.1fs  ordering: %.1fs  inbreeding: %.1fs' % (loaded - start, ordered - loaded, computed - ordered))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,90 @@
+''' Measures load_csv throughput in rows/sec on the bundled data files, before and after the column plan and date cache '''
+import csv
+import os
+import sys
+import timeit
+from datetime import date
+from time import strptime
+
+__author__ = 'adamj'
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'pedigrees'))
+sys.path.insert(0, os.path.join(ROOT, 'conf'))
+
+import functions
+import pedigrees
+
+CASES = [
+    ('settings.intdata.py', 'Intdata.csv'),
+    ('settings.ped.py', 'PED.csv'),
+]
+
+def legacy_coerce_date_value(value):
+    ''' coerce_date_value as it was before format sniffing and caching '''
+    try:
+        return date(*strptime(value, '%Y/%m/%d')[:3])
+    except ValueError:
+        try:
+            return date(*strptime(value, '%m/%d/%Y')[:3])
+        except ValueError:
+            try:
+                value = int(value)
+                return date(1900+value,1,1)
+            except ValueError:
+                return None
+
+def legacy_load_csv(settings, input_file):
+    ''' load_csv as it was before the precompiled column plan '''
+    column_names_list = settings.get('column_names_list', [])
+    column_value_coercion_map = settings.get('column_value_coercion_map', {})
+    column_name_coercion_map = settings.get('column_name_coercion_map', {})
+    reader = csv.reader(open(input_file, 'r'))
+    header = next(reader)
+    rows = {}
+    auto_id = -1
+    for row in reader:
+        zipped_row = zip(header, row)
+        row_id_value = auto_id
+        row_dict = {}
+        for column, value in zipped_row:
+            if column in column_names_list and column_name_coercion_map.get(column) is not None:
+                value = column_value_coercion_map.get(column, lambda v: v)(value)
+                row_dict[column_name_coercion_map[column]] = value
+                if column == settings.get('id_column_name'):
+                    row_id_value = value
+        rows[row_id_value] = row_dict
+        if row_id_value == auto_id:
+            auto_id -= 1
+    return rows
+
+def legacy_settings(settings):
+    ''' Returns a copy of settings with the legacy date coercer swapped in '''
+    settings = dict(settings)
+    settings['column_value_coercion_map'] = dict((column, legacy_coerce_date_value if coercer is functions.coerce_date_value else coercer)
+                                                 for column, coercer in settings['column_value_coercion_map'].items())
+    return settings
+
+def measure(function, settings, input_file, repeat):
+    ''' Returns the best rows/sec over repeat cold-cache runs along with the loaded rows '''
+    timings = []
+    for i in range(repeat):
+        functions.date_value_cache.clear()
+        start = timeit.default_timer()
+        rows = function(settings, input_file)
+        timings.append(timeit.default_timer() - start)
+    return (len(rows) / min(timings), rows)
+
+def main(repeat=5):
+    print('%-14s %14s %14s %8s' % ('file', 'before rows/s', 'after rows/s', 'speedup'))
+    for settings_name, data_name in CASES:
+        settings = pedigrees.load_settings(os.path.join(ROOT, 'conf', settings_name))
+        input_file = os.path.join(ROOT, 'data', data_name)
+        before, legacy_rows = measure(legacy_load_csv, legacy_settings(settings), input_file, repeat)
+        after, rows = measure(pedigrees.load_csv, settings, input_file, repeat)
+        if rows != legacy_rows:
+            raise AssertionError('load_csv output for %s differs from the legacy implementation' % data_name)
+        print('%-14s %14.0f %14.0f %7.2fx' % (data_name, before, after, after / before))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
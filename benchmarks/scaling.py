@@ -0,0 +1,131 @@
+''' Runs every CLI mode against a fresh database at several synthetic pedigree sizes, recording wall time, peak RSS and
+SQL statement counts per mode so scaling regressions show up. Each mode runs in its own process.
+
+Usage: scaling.py [SIZE ...] [--database URL] [--output FILE] [--modes MODE ...] '''
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+__author__ = 'adamj'
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'pedigrees'))
+sys.path.insert(0, os.path.join(ROOT, 'conf'))
+
+import pedigrees
+
+LAYOUT = os.path.join(ROOT, 'conf', 'settings.intdata.py')
+
+def mode_plan(directory, input_file):
+    ''' Returns the (label, mode, kwargs) runs of a benchmark, in the order the pipeline normally runs them '''
+    return [
+        ('init_database', 'init_database', {}),
+        ('import_csv', 'import_csv', {'input_file': input_file}),
+        ('import_csv (unchanged)', 'import_csv', {'input_file': input_file}),
+        ('validate', 'validate', {'output_file': os.path.join(directory, 'validation.json')}),
+        ('fix_misgenders', 'fix_misgenders', {}),
+        ('fix_invalid_genders', 'fix_invalid_genders', {}),
+        ('fix_birth_dates', 'fix_birth_dates', {}),
+        ('generate_dummy_animals', 'generate_dummy_animals', {}),
+        ('set_base_population_members', 'set_base_population_members', {}),
+        ('locate_disconnected_animals', 'locate_disconnected_animals', {}),
+        ('compute_inbreeding', 'compute_inbreeding', {}),
+        ('compute_completeness', 'compute_completeness', {'output_file': os.path.join(directory, 'completeness.csv')}),
+        ('snapshot', 'snapshot', {'output_directory': os.path.join(directory, 'snapshot')}),
+        ('generate_popreport_input', 'generate_popreport_input', {'output_file': os.path.join(directory, 'popreport.txt')}),
+        ('generate_endog_input', 'generate_endog_input', {'output_file': os.path.join(directory, 'endog.dbf')}),
+        ('batch_export', 'batch_export', {'targets': [('popreport', [2], os.path.join(directory, 'popreport_2.txt')),
+                                                      ('endog', [2], os.path.join(directory, 'endog_2.dbf')),
+                                                      ('popreport', [3], os.path.join(directory, 'popreport_3.txt')),
+                                                      ('endog', [3], os.path.join(directory, 'endog_3.dbf'))]}),
+    ]
+
+def run_mode(mode, settings_file, kwargs, result_file):
+    ''' Runs a single mode in this process, counting SQL statements, and writes the count to result_file '''
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    logging.basicConfig(level=logging.INFO)
+    statements = [0]
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def count_statement(connection, cursor, statement, parameters, context, executemany):
+        statements[0] += 1
+    getattr(pedigrees, mode)(settings_file, **kwargs)
+    with open(result_file, 'w') as output:
+        json.dump({'statements': statements[0]}, output)
+
+def measure_mode(mode, settings_file, kwargs, directory, log):
+    ''' Runs a mode in a child process. Returns (seconds, peak RSS in MB, SQL statements) or None values on failure '''
+    result_file = os.path.join(directory, 'result.json')
+    if os.path.exists(result_file):
+        os.remove(result_file)
+    command = [sys.executable, os.path.abspath(__file__), '--run', mode, settings_file, json.dumps(kwargs), result_file]
+    start = timeit.default_timer()
+    process = subprocess.Popen(command, stdout=log, stderr=log)
+    # wait4 reports the resource usage of this child alone
+    pid, status, usage = os.wait4(process.pid, 0)
+    process.returncode = status
+    seconds = timeit.default_timer() - start
+    if status or not os.path.exists(result_file):
+        return (seconds, usage.ru_maxrss / 1024.0, None)
+    with open(result_file) as result:
+        return (seconds, usage.ru_maxrss / 1024.0, json.load(result)['statements'])
+
+def benchmark_size(size, database, directory, modes, seed):
+    ''' Generates a pedigree of size Animals, resets the database and measures every mode. Returns a list of result dicts '''
+    from sqlalchemy import create_engine
+    import synthetic
+    input_file = os.path.join(directory, 'synthetic_%d.csv' % size)
+    synthetic.write_csv(synthetic.synthetic_pedigree(size, seed), input_file, LAYOUT)
+    connection_string = database or 'sqlite:///%s' % os.path.join(directory, 'pedigrees_%d.db' % size)
+    pedigrees.Base.metadata.drop_all(create_engine(connection_string))
+    settings_file = os.path.join(directory, 'settings_%d.py' % size)
+    with open(settings_file, 'w') as output:
+        output.write('import sys\nsys.path.insert(0, %r)\nexecfile(%r)\nconnection_string = %r\n' %
+                     (os.path.join(ROOT, 'conf'), LAYOUT, connection_string))
+    results = []
+    with open(os.path.join(directory, 'benchmark_%d.log' % size), 'w') as log:
+        for label, mode, kwargs in mode_plan(directory, input_file):
+            if modes and mode not in modes:
+                continue
+            seconds, peak_rss, statements = measure_mode(mode, settings_file, kwargs, directory, log)
+            results.append({'size': size, 'mode': label, 'seconds': seconds, 'peak_rss_mb': peak_rss, 'statements': statements})
+            print('%10d %-30s %10.2f %12.1f %12s' % (size, label, seconds, peak_rss, 'failed' if statements is None else statements))
+            sys.stdout.flush()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sizes', nargs='*', type=int, default=[10000, 100000], help='Pedigree sizes to benchmark')
+    parser.add_argument('--database', help='Connection string of a scratch database, e.g. a local PostgreSQL one. Its tables are dropped before every size. Defaults to a SQLite file per size')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--modes', nargs='+', help='Only run these modes (init_database and import_csv are needed for a populated database)')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the synthetic pedigree')
+    parser.add_argument('--keep', action='store_true', help='Keep the generated files and databases')
+    namespace = parser.parse_args()
+    directory = tempfile.mkdtemp(prefix='pedigrees_benchmark_')
+    print('%10s %-30s %10s %12s %12s' % ('animals', 'mode', 'seconds', 'peak RSS MB', 'statements'))
+    results = []
+    try:
+        for size in namespace.sizes:
+            results.extend(benchmark_size(size, namespace.database, directory, namespace.modes, namespace.seed))
+    finally:
+        if namespace.keep:
+            print('Benchmark files kept in %s' % directory)
+        else:
+            shutil.rmtree(directory)
+    if namespace.output:
+        with open(namespace.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--run']:
+        mode, settings_file, kwargs, result_file = sys.argv[2:6]
+        run_mode(mode, settings_file, json.loads(kwargs), result_file)
+    else:
+        main()
@@ -0,0 +1,40 @@
+''' Compares building a PedigreeGraph from rows with reading it back from a columnar snapshot '''
+import imp
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+__author__ = 'adamj'
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'pedigrees'))
+
+from graph import PedigreeGraph
+from snapshots import write_snapshot, read_snapshot
+
+# Shares the synthetic pedigree of the inbreeding benchmark, whose module name clashes with src/pedigrees/inbreeding.py
+synthetic_rows = imp.load_source('inbreeding_benchmark', os.path.join(ROOT, 'benchmarks', 'inbreeding.py')).synthetic_rows
+
+def main(count=1000000):
+    directory = tempfile.mkdtemp()
+    try:
+        rows = synthetic_rows(count)
+        start = timeit.default_timer()
+        graph = PedigreeGraph.from_rows(rows)
+        ordering = graph.topological_order()
+        built = timeit.default_timer()
+        write_snapshot(graph, directory, 1, ordering)
+        written = timeit.default_timer()
+        loaded_graph = read_snapshot(directory, 1)
+        read = timeit.default_timer()
+        if loaded_graph.ids != graph.ids or loaded_graph.children != graph.children or loaded_graph.ordering != ordering:
+            raise AssertionError('Snapshot graph differs from the original for %d rows' % count)
+        print('Animals: %d' % count)
+        print('graph build and ordering: %.2fs  snapshot write: %.3fs  snapshot read: %.3fs' % (built - start, written - built, read - written))
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,119 @@
+''' Deterministic synthetic pedigree generator writing CSVs in the conf/settings.*.py column layouts.
+
+Usage: synthetic.py COUNT OUTPUT_FILE [SETTINGS_FILE] [SEED] '''
+import csv
+import datetime
+import os
+import random
+import sys
+
+__author__ = 'adamj'
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'pedigrees'))
+sys.path.insert(0, os.path.join(ROOT, 'conf'))
+
+import pedigrees
+
+MALE = 1
+FEMALE = 2
+
+def animal_id(year, serial, serial_digits):
+    ''' Builds an id with the birth year prefix generate_birth_date expects: YY for 19YY and 1YY for 2000 onwards '''
+    return (year - 1900) * 10 ** serial_digits + serial
+
+def synthetic_pedigree(count, seed=1, first_year=1979, years=30, founder_years=3, founder_rate=0.02,
+                       sire_rate=0.02, missing_parent_rate=0.03, disconnected_rate=0.01, sex_conflict_rate=0.002,
+                       invalid_sex_rate=0.001, missing_birth_date_rate=0.01):
+    ''' Yields count animal row dicts (id, sire_id, dam_id, birth_date, sex, group, base_population_member) in birth
+    year order. Each yearly cohort after the founder years descends from parents born two to eight years earlier, with
+    a few heavily reused sires per year. A fraction of the animals reference parents missing from the file, are
+    isolated, are recorded with a sex contradicting their role as a parent, carry an invalid sex or lack a birth date '''
+    generator = random.Random(seed)
+    per_year = max(1, count // years)
+    serial_digits = max(4, len(str(2 * per_year)))
+    males = {}
+    females = {}
+    produced = 0
+    for offset in range(years):
+        year = first_year + offset
+        cohort = per_year if offset < years - 1 else count - produced
+        males[year] = []
+        females[year] = []
+        parent_years = [y for y in range(year - 8, year - 1) if y in males]
+        sires = []
+        if offset >= founder_years and parent_years:
+            candidates = [i for y in parent_years for i in males[y]]
+            sires = generator.sample(candidates, min(len(candidates), max(1, int(cohort * sire_rate))))
+        dams = [i for y in parent_years for i in females[y]] if sires else []
+        for serial in range(cohort):
+            row_id = animal_id(year, serial, serial_digits)
+            sex = MALE if generator.random() < 0.5 else FEMALE
+            founder = not sires or not dams or generator.random() < founder_rate
+            disconnected = generator.random() < disconnected_rate
+            sire_id = None
+            dam_id = None
+            if not founder and not disconnected:
+                # Skewed choice so the first few sires of the year father most of the cohort
+                sire_id = sires[int(len(sires) * generator.random() ** 3)]
+                dam_id = dams[generator.randrange(len(dams))]
+                if generator.random() < missing_parent_rate:
+                    sire_id = animal_id(year - generator.randint(2, 8), per_year + generator.randrange(per_year), serial_digits)
+                if generator.random() < missing_parent_rate:
+                    dam_id = animal_id(year - generator.randint(2, 8), per_year + generator.randrange(per_year), serial_digits)
+            if not disconnected:
+                (males if sex == MALE else females)[year].append(row_id)
+            recorded_sex = sex
+            if generator.random() < sex_conflict_rate:
+                recorded_sex = FEMALE if sex == MALE else MALE
+            elif generator.random() < invalid_sex_rate:
+                recorded_sex = generator.choice([0, 9])
+            birth_date = None
+            if generator.random() >= missing_birth_date_rate:
+                birth_date = datetime.date(year, generator.randint(1, 12), generator.randint(1, 28))
+            produced += 1
+            yield {'id': row_id,
+                   'sire_id': sire_id,
+                   'dam_id': dam_id,
+                   'birth_date': birth_date,
+                   'sex': recorded_sex,
+                   'group': generator.choice([0, 1]) if founder else generator.choice([2, 2, 2, 3, 3]),
+                   'base_population_member': founder and offset < founder_years}
+
+def format_value(column, attribute, row):
+    ''' Formats a row value for a CSV column the way the bundled data files do '''
+    if attribute in ('id', 'sire_id', 'dam_id'):
+        return str(row[attribute] or 0)
+    if attribute in ('group', 'sex'):
+        return str(row[attribute])
+    if attribute == 'base_population_member':
+        return '1' if row[attribute] else ''
+    birth_date = row['birth_date']
+    if birth_date is None:
+        return ''
+    if column == 'YR':
+        return str(birth_date.year - 1900)
+    if attribute == 'birth_date' or column == 'WDAT':
+        value = birth_date if attribute == 'birth_date' else birth_date + datetime.timedelta(days=100)
+        return '%04d/%02d/%02d' % (value.year, value.month, value.day)
+    return ''
+
+def write_csv(rows, output_file, settings_file):
+    ''' Writes rows to output_file using the column layout of settings_file. Returns the number of rows written '''
+    settings = pedigrees.load_settings(settings_file)
+    columns = [(column, settings['column_name_coercion_map'].get(column)) for column in settings['column_names_list']]
+    count = 0
+    with open(output_file, 'wb') as output:
+        writer = csv.writer(output)
+        writer.writerow([column for column, attribute in columns])
+        for row in rows:
+            writer.writerow([format_value(column, attribute, row) for column, attribute in columns])
+            count += 1
+    return count
+
+def main(count, output_file, settings_file=os.path.join(ROOT, 'conf', 'settings.intdata.py'), seed=1):
+    written = write_csv(synthetic_pedigree(int(count), int(seed)), output_file, settings_file)
+    print('Wrote %d synthetic Animals to %s' % (written, output_file))
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -3,7 +3,35 @@ from time import strptime
 
 __author__ = 'adamj'
 
+# Herd book files repeat the same handful of date strings on thousands of rows, so parsed values are cached by raw string
+date_value_cache = {}
+
 def coerce_date_value(value):
+    try:
+        return date_value_cache[value]
+    except KeyError:
+        coerced_value = date_value_cache[value] = parse_date_value(value)
+        return coerced_value
+
+def parse_date_value(value):
+    # Sniff the layout from the separators instead of letting strptime fail its way through each format
+    if '/' not in value:
+        try:
+            return date(1900 + int(value), 1, 1)
+        except ValueError:
+            return None
+    parts = value.split('/')
+    if len(parts) == 3 and parts[0].isdigit() and parts[1].isdigit() and parts[2].isdigit():
+        try:
+            if len(parts[0]) == 4 and len(parts[1]) <= 2 and len(parts[2]) <= 2:
+                return date(int(parts[0]), int(parts[1]), int(parts[2]))
+            if len(parts[2]) == 4 and len(parts[0]) <= 2 and len(parts[1]) <= 2:
+                return date(int(parts[2]), int(parts[0]), int(parts[1]))
+        except ValueError:
+            return None
+    return strptime_date_value(value)
+
+def strptime_date_value(value):
     try:
         return date(*strptime(value, '%Y/%m/%d')[:3])
     except ValueError:
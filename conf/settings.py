@@ -15,3 +15,34 @@ gender_map = {
     'FEMALE': 2
 }
 
+# Keyword arguments passed to sqlalchemy.create_engine, e.g. {'pool_size': 10, 'max_overflow': 20} or, for psycopg2,
+# {'executemany_mode': 'values', 'executemany_values_page_size': 10000}. psycopg2 defaults to executemany_mode 'values'
+engine_options = {}
+
+# Number of CSV rows import_csv reads per chunk. Multi-row statements are split further to stay within the bind
+# parameter limit of the database driver
+import_chunk_size = 2500
+# Drop the animals table indexes while import_csv loads, then rebuild them and analyze the table. Faster for large
+# initial loads, slower for small incremental ones. Without transactional DDL (PostgreSQL has it) an interrupted load
+# can leave the indexes dropped until init_database recreates them. --bulk-load and --no-bulk-load override this
+bulk_load = False
+
+# locate_disconnected_animals flags animals in connected components smaller than this. 2 flags isolated animals only
+min_component_size = 2
+
+# Number of generations covered by the pedigree completeness index computed by compute_completeness
+completeness_generations = 5
+
+# Directory holding the columnar snapshot written by the snapshot mode. When set, modes map the pedigree from the
+# snapshot instead of reading the animals table, as long as the table has not changed since the snapshot was taken
+snapshot_directory = None
+
+# (format, groups, output_file) targets written by batch_export, format being 'popreport' or 'endog' and groups a list
+# of Group values or None for every Animal, e.g. ('endog', [1, 2], 'out/endog_1_2.dbf')
+export_targets = []
+# Number of batch_export worker processes, None for the CPU count
+export_workers = None
+
+# Ordered modes run by the pipeline mode. Each entry is a mode name or a (mode, kwargs) pair, e.g.
+# ('import_csv', {'input_file': 'data/PED.csv'})
+pipeline_steps = []
@@ -1,47 +1,102 @@
 import argparse
 import os
 import pedigrees
+import instrumentation
 import logging
 
 __author__ = 'adamj'
 
 if __name__ == '__main__':
-    # Init Logging
-    logging.basicConfig(level=logging.INFO)
     # Set up argument parser
     parser = argparse.ArgumentParser()
     mode_choices = ['init_database', 'import_csv', 'fix_misgenders','fix_invalid_genders', 'fix_birth_dates',
                     'generate_dummy_animals', 'set_base_population_members', 'generate_popreport_input',
-                    'generate_endog_input', 'locate_disconnected_animals']
+                    'generate_endog_input', 'locate_disconnected_animals', 'validate', 'compute_inbreeding',
+                    'compute_completeness', 'snapshot', 'batch_export', 'pipeline']
     parser.add_argument('mode',
                         type=lambda s: s.lower(),
                         choices=mode_choices,
                         help='An operation mode. One of: %s' % ', '.join(mode_choices))
     parser.add_argument('settings_file', help='A python file containing settings data that will be imported for use by the application')
     parser.add_argument('-f', '--file', type=os.path.abspath, help='A file to be used for data input/output')
-    parser.add_argument('-g', '--groups', nargs='+', type=lambda v: int(v), help='A list of Group values to include in processing. Only applies to generate_?_input modes')
+    parser.add_argument('-g', '--groups', nargs='+', type=lambda v: int(v), help='A list of Group values to include in processing. Only applies to generate_?_input and compute_inbreeding modes')
     method_choices = ['standard', 'noparents']
     default_method_choice = method_choices[0]
     parser.add_argument('-m', '--method', type=lambda s: s.lower(),
                         help='Select method used for set_base_population_members. One of: %s. Only applies to set_base_population_members mode. Defaults to %s' % (', '.join(method_choices), default_method_choice))
     parser.add_argument('-s', '--skip-update', dest='update', action='store_false', help='Also Update existing animals based on input data. Only applies to import_csv mode')
+    parser.add_argument('-c', '--chunk-size', type=lambda v: int(v), help='Number of CSV rows read and written per chunk. Only applies to import_csv mode. Defaults to the import_chunk_size setting or 2500')
+    parser.add_argument('--bulk-load', dest='bulk_load', action='store_true', default=None, help='Drop the animals table indexes for the import, then rebuild them and analyze the table. Only applies to import_csv mode. Defaults to the bulk_load setting')
+    parser.add_argument('--no-bulk-load', dest='bulk_load', action='store_false', default=None, help='Keep the animals table indexes during the import, overriding the bulk_load setting. Only applies to import_csv mode')
     parser.add_argument('-d', '--delete', action='store_true', help='Determine whether to delete located animals. Only applies to locate_disconnected_animals method')
-    #TODO: Add logging related args
+    parser.add_argument('--min-component-size', type=lambda v: int(v), help='Locate animals in connected components smaller than this. Only applies to locate_disconnected_animals mode. Defaults to the min_component_size setting or 2')
+    parser.add_argument('--depth', type=lambda v: int(v), help='Number of generations covered by the pedigree completeness index. Only applies to compute_completeness mode. Defaults to the completeness_generations setting or 5')
+    parser.add_argument('--dirty-only', action='store_true', help='Only process the Animals changed by the last import_csv and their descendants. Applies to fix_birth_dates, generate_dummy_animals, set_base_population_members and compute_inbreeding modes')
+    parser.add_argument('--fix', action='store_true', help='Apply all corrections in one bulk transaction. Only applies to validate mode')
+    parser.add_argument('--targets', nargs='+', help='Export targets as FORMAT=FILE or FORMAT:GROUP,GROUP=FILE, FORMAT being popreport or endog, overriding the export_targets setting. Only applies to batch_export mode')
+    parser.add_argument('--workers', type=lambda v: int(v), help='Number of export worker processes. Only applies to batch_export mode. Defaults to the export_workers setting or the CPU count')
+    parser.add_argument('--steps', nargs='+', help='Ordered list of MODE or MODE=FILE steps, overriding the pipeline_steps setting. Only applies to pipeline mode')
+    parser.add_argument('--log-level', type=lambda s: s.upper(), default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help='Logging level. Defaults to INFO')
+    parser.add_argument('--log-file', type=os.path.abspath, help='Write log messages to this file instead of stderr')
+    parser.add_argument('--report', type=os.path.abspath, help='Write a JSON run report with per phase timings, SQL statement counts and durations, row counts and peak memory to this file')
+    parser.add_argument('--id-file', type=os.path.abspath, help='Stream complete listings of located Animal ids to this CSV file instead of logging a sample of them')
+    parser.add_argument('--id-limit', type=lambda v: int(v), default=instrumentation.DEFAULT_ID_LIMIT, help='Number of ids logged per listing when no --id-file is given. Defaults to %d' % instrumentation.DEFAULT_ID_LIMIT)
     # Process arguments and prepare
     namespace = parser.parse_args()
-    kwargs = { 'settings_file': namespace.settings_file }
-    if namespace.mode in ['import_csv', 'locate_disconnected_animals'] and namespace.file:
-        kwargs['input_file'] = namespace.file
-    if namespace.mode in ['generate_popreport_input', 'generate_endog_input'] and namespace.file:
-        kwargs['output_file'] = namespace.file
-    if namespace.mode == 'import_csv':
-        kwargs['update'] = namespace.update
-    if namespace.mode == 'set_base_population_members' and namespace.method:
-        kwargs['method'] = namespace.method
-    if namespace.mode in ['generate_popreport_input', 'generate_endog_input'] and namespace.groups:
-        kwargs['groups'] = namespace.groups
-    if namespace.mode == 'locate_disconnected_animals':
-        kwargs['delete'] = namespace.delete
-    #TODO: Process logging related args
+    def build_kwargs(mode, file):
+        kwargs = {}
+        if mode in ['import_csv', 'locate_disconnected_animals'] and file:
+            kwargs['input_file'] = file
+        if mode in ['generate_popreport_input', 'generate_endog_input', 'validate', 'compute_completeness'] and file:
+            kwargs['output_file'] = file
+        if mode == 'snapshot' and file:
+            kwargs['output_directory'] = file
+        if mode == 'import_csv':
+            kwargs['update'] = namespace.update
+            if namespace.chunk_size:
+                kwargs['chunk_size'] = namespace.chunk_size
+            if namespace.bulk_load is not None:
+                kwargs['bulk_load'] = namespace.bulk_load
+        if mode == 'set_base_population_members' and namespace.method:
+            kwargs['method'] = namespace.method
+        if mode in ['generate_popreport_input', 'generate_endog_input', 'compute_inbreeding'] and namespace.groups:
+            kwargs['groups'] = namespace.groups
+        if mode == 'compute_completeness' and namespace.depth:
+            kwargs['depth'] = namespace.depth
+        if mode == 'validate':
+            kwargs['fix'] = namespace.fix
+        if mode in ['fix_birth_dates', 'generate_dummy_animals', 'set_base_population_members', 'compute_inbreeding']:
+            kwargs['dirty_only'] = namespace.dirty_only
+        if mode == 'batch_export':
+            if namespace.targets:
+                kwargs['targets'] = []
+                for target in namespace.targets:
+                    format, separator, file = target.partition('=')
+                    format, separator, groups = format.partition(':')
+                    kwargs['targets'].append((format, [int(group) for group in groups.split(',')] if groups else None, os.path.abspath(file)))
+            if namespace.workers:
+                kwargs['workers'] = namespace.workers
+        if mode == 'locate_disconnected_animals':
+            kwargs['delete'] = namespace.delete
+            if namespace.min_component_size:
+                kwargs['min_component_size'] = namespace.min_component_size
+        return kwargs
+    if namespace.mode == 'pipeline':
+        kwargs = {}
+        if namespace.steps:
+            # Each step is MODE or MODE=FILE, so input and output files can differ between steps
+            kwargs['steps'] = []
+            for step in namespace.steps:
+                mode, separator, file = step.partition('=')
+                kwargs['steps'].append((mode.lower(), build_kwargs(mode.lower(), os.path.abspath(file) if file else None)))
+    else:
+        kwargs = build_kwargs(namespace.mode, namespace.file)
+    kwargs['settings_file'] = namespace.settings_file
+    # Init Logging
+    logging.basicConfig(level=getattr(logging, namespace.log_level), filename=namespace.log_file)
     # Execute
-    getattr(pedigrees, namespace.mode)(**kwargs)
+    instrumentation.start_run(namespace.mode, namespace.id_file, namespace.id_limit)
+    try:
+        getattr(pedigrees, namespace.mode)(**kwargs)
+    finally:
+        instrumentation.finish_run(namespace.report)
@@ -0,0 +1,53 @@
+import numpy
+
+__author__ = 'adamj'
+
+def pedigree_completeness(sires, dams, generations, known, depth=5):
+    ''' Computes pedigree depth measures for every graph index, propagating parent values one generation at a time.
+
+    sires and dams hold parent graph indexes (negative when unknown), generations the generation number of every index
+    and known a mask of the animals that count as known ancestors, so dummy parents can be treated as unknown. Returns
+    a dict of float64 or int32 arrays aligned with the graph indexes:
+
+    pci: MacCluer et al. (1983) pedigree completeness index over depth generations, the harmonic mean of the
+         paternal and maternal mean proportions of known ancestors per generation
+    maximum_generations: generations separating the animal from its most distant known ancestor
+    complete_generations: generations up to which every ancestor is known
+    equivalent_generations: sum of (1/2)^n over all known ancestors, n generations back '''
+    count = len(sires)
+    sires = numpy.asarray(sires, dtype=numpy.int64)
+    dams = numpy.asarray(dams, dtype=numpy.int64)
+    known = numpy.asarray(known, dtype=bool)
+    # Unknown and not known parents point at a sentinel row holding -1 / 0 values, so no per-parent branching is needed
+    sentinel = count
+    sire = numpy.where((sires >= 0) & known[numpy.maximum(sires, 0)], sires, sentinel)
+    dam = numpy.where((dams >= 0) & known[numpy.maximum(dams, 0)], dams, sentinel)
+    maximum = numpy.full(count + 1, -1, dtype=numpy.int32)
+    complete = numpy.full(count + 1, -1, dtype=numpy.int32)
+    equivalent = numpy.full(count + 1, -1.0)
+    # proportions[i, k] is the proportion of known ancestors of i, k + 1 generations back
+    proportions = numpy.zeros((count + 1, depth))
+    levels = numpy.asarray(generations, dtype=numpy.int64)
+    by_level = numpy.argsort(levels, kind='mergesort')
+    level_starts = numpy.searchsorted(levels[by_level], numpy.arange(levels.max() + 2 if count else 1))
+    for start, end in zip(level_starts[:-1], level_starts[1:]):
+        members = by_level[start:end]
+        s = sire[members]
+        d = dam[members]
+        maximum[members] = numpy.maximum(maximum[s], maximum[d]) + 1
+        complete[members] = numpy.minimum(complete[s], complete[d]) + 1
+        equivalent[members] = 0.5 * (1.0 + equivalent[s]) + 0.5 * (1.0 + equivalent[d])
+        proportions[members, 0] = 0.5 * ((s != sentinel).astype(float) + (d != sentinel))
+        proportions[members, 1:] = 0.5 * (proportions[s, :-1] + proportions[d, :-1])
+    maximum = maximum[:count]
+    complete = complete[:count]
+    equivalent = equivalent[:count]
+    # Each side's mean proportion: the parent itself one generation back, then the parent's ancestors
+    paternal = ((sire[:count] != sentinel) + proportions[sire[:count], :-1].sum(axis=1)) / depth
+    maternal = ((dam[:count] != sentinel) + proportions[dam[:count], :-1].sum(axis=1)) / depth
+    total = paternal + maternal
+    pci = numpy.where(total > 0, 2.0 * paternal * maternal / numpy.where(total > 0, total, 1.0), 0.0)
+    return {'pci': pci,
+            'maximum_generations': maximum,
+            'complete_generations': complete,
+            'equivalent_generations': equivalent}
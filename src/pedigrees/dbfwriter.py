@@ -0,0 +1,85 @@
+import datetime
+import struct
+
+__author__ = 'adamj'
+
+# (name, type, length, decimals) for every column of the ENDOG input file
+ENDOG_FIELDS = (
+    ('ID', 'N', 16, 0),
+    ('SIRE_ID', 'N', 16, 0),
+    ('DAM_ID', 'N', 16, 0),
+    ('BIRTH_DATE', 'D', 8, 0),
+    ('S', 'N', 1, 0),
+    ('GROUP', 'N', 16, 0),
+    ('REFERENCE', 'N', 1, 0),
+)
+
+class EndogDbfWriter(object):
+    ''' Writes ENDOG records to a dBase III file through a preallocated block buffer, producing the same bytes as dbfpy '''
+
+    def __init__(self, output_file, block_records=8192):
+        self.record_length = 1 + sum(length for name, type, length, decimals in ENDOG_FIELDS)
+        self.header_length = 32 + 32 * len(ENDOG_FIELDS) + 1
+        self.record_format = ' ' + ''.join('%s' if type == 'D' else '%%%dd' % length for name, type, length, decimals in ENDOG_FIELDS)
+        self.block = bytearray(self.record_length * block_records)
+        self.block_offset = 0
+        self.count = 0
+        self.date_cache = {}
+        self.stream = open(output_file, 'wb')
+        self.stream.write(self.header())
+
+    def header(self):
+        ''' Encodes the file header and field descriptors for the current record count '''
+        today = datetime.date.today()
+        parts = [struct.pack('<4BI2H', 0x03, today.year - 1900, today.month, today.day, self.count, self.header_length, self.record_length) + b'\0' * 20]
+        start = 1
+        for name, type, length, decimals in ENDOG_FIELDS:
+            parts.append(name.encode('ascii').ljust(11, b'\0') + type.encode('ascii') + struct.pack('<L4B', start, length, decimals, 0, 0) + b'\0' * 12)
+            start += length
+        parts.append(b'\x0D')
+        return b''.join(parts)
+
+    def encode_date(self, value):
+        ''' Encodes a date as YYYYMMDD, or blanks when missing '''
+        if not value:
+            return '        '
+        try:
+            return self.date_cache[value]
+        except KeyError:
+            encoded = self.date_cache[value] = '%04d%02d%02d' % (value.year, value.month, value.day)
+            return encoded
+
+    def write(self, animal_id, sire_id, dam_id, birth_date, sex, group, reference):
+        ''' Packs a single record into the block buffer, flushing the block to disk when it is full '''
+        values = (animal_id or 0, sire_id or 0, dam_id or 0, self.encode_date(birth_date), sex or 0, group or 0, reference or 0)
+        record = (self.record_format % values).encode('ascii')
+        if len(record) != self.record_length:
+            self.raise_invalid_record(values, record)
+        end = self.block_offset + self.record_length
+        self.block[self.block_offset:end] = record
+        self.block_offset = end
+        self.count += 1
+        if end == len(self.block):
+            self.flush()
+
+    def raise_invalid_record(self, values, record):
+        ''' Raises the same error dbfpy would for the first value that does not fit its field, or a ValueError naming the
+        record length when the record is malformed for any other reason '''
+        for (name, type, length, decimals), value in zip(ENDOG_FIELDS, values):
+            if type == 'N' and len('%d' % value) > length:
+                raise ValueError('[%s] Numeric overflow: %d (field width: %i)' % (name, value, length))
+        raise ValueError('Record of %d bytes does not match the record length of %d: %r' % (len(record), self.record_length, values))
+
+    def flush(self):
+        ''' Writes the filled part of the block buffer to disk '''
+        self.stream.write(memoryview(self.block)[:self.block_offset])
+        self.block_offset = 0
+
+    def close(self):
+        ''' Flushes buffered records, writes the end-of-file marker and patches the header record count '''
+        self.flush()
+        if self.count:
+            self.stream.write(b'\x1A')
+        self.stream.seek(0)
+        self.stream.write(self.header())
+        self.stream.close()
@@ -0,0 +1,386 @@
+import datetime
+from array import array
+from collections import namedtuple
+
+__author__ = 'adamj'
+
+# Index value used when a parent is unknown or not present in the animals table
+NO_INDEX = -1
+# Stand-in for NULL sex and group values inside the integer arrays
+NULL_VALUE = -2147483648
+# Bit flags stored per animal
+BASE_POPULATION_MEMBER = 1
+DUMMY_ANIMAL = 2
+
+# Row shape emitted for the generate modes
+GenerateRow = namedtuple('GenerateRow', 'id sire_id dam_id birth_date sex group base_population_member')
+
+class PedigreeGraph(object):
+    ''' Compact, array-backed pedigree with ids mapped to dense indexes and a CSR style children index '''
+
+    def __init__(self, ids, sire_ids, dam_ids, sexes, groups, birth_dates, flags, sires=None, dams=None,
+                 child_offsets=None, children=None, ordering=None):
+        ''' Parent indexes, the children index and the ordering are derived from the id arrays unless given, as they
+        are when the arrays are loaded from a snapshot '''
+        self.ids = ids
+        self.sire_ids = sire_ids
+        self.dam_ids = dam_ids
+        self.sexes = sexes
+        self.groups = groups
+        self.birth_dates = birth_dates
+        self.flags = flags
+        if sires is None or dams is None:
+            index = dict((animal_id, i) for i, animal_id in enumerate(ids))
+            sires = array('i', (index.get(sire_id, NO_INDEX) for sire_id in sire_ids))
+            dams = array('i', (index.get(dam_id, NO_INDEX) for dam_id in dam_ids))
+        self.sires = sires
+        self.dams = dams
+        if child_offsets is None or children is None:
+            child_offsets, children = self._build_children()
+        self.child_offsets = child_offsets
+        self.children = children
+        self.ordering = ordering
+        # Indexes on parentage cycles, known once the ordering is, which a stored ordering only is for acyclic pedigrees
+        self.cycles = None if ordering is None else array('i')
+
+    @classmethod
+    def from_rows(cls, rows):
+        ''' Builds a graph from (id, sire_id, dam_id, sex, group, birth_date, base_population_member, dummy_animal) tuples '''
+        ids = array('l')
+        sire_ids = array('l')
+        dam_ids = array('l')
+        sexes = array('i')
+        groups = array('i')
+        birth_dates = array('i')
+        flags = array('b')
+        for animal_id, sire_id, dam_id, sex, group, birth_date, base_population_member, dummy_animal in rows:
+            ids.append(animal_id)
+            sire_ids.append(sire_id or 0)
+            dam_ids.append(dam_id or 0)
+            sexes.append(NULL_VALUE if sex is None else sex)
+            groups.append(NULL_VALUE if group is None else group)
+            birth_dates.append(birth_date.toordinal() if birth_date is not None else 0)
+            flags.append((BASE_POPULATION_MEMBER if base_population_member else 0) | (DUMMY_ANIMAL if dummy_animal else 0))
+        return cls(ids, sire_ids, dam_ids, sexes, groups, birth_dates, flags)
+
+    def _build_children(self):
+        ''' Counting sort of parent -> child edges into offsets and a flat children array '''
+        count = len(self.ids)
+        offsets = array('i', [0]) * (count + 1)
+        for parents in (self.sires, self.dams):
+            for parent in parents:
+                if parent != NO_INDEX:
+                    offsets[parent + 1] += 1
+        for i in range(count):
+            offsets[i + 1] += offsets[i]
+        children = array('i', [0]) * offsets[count]
+        position = array('i', offsets[:count])
+        for parents in (self.sires, self.dams):
+            for child, parent in enumerate(parents):
+                if parent != NO_INDEX:
+                    children[position[parent]] = child
+                    position[parent] += 1
+        return (offsets, children)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def children_of(self, i):
+        ''' Returns the child indexes of the animal at index i '''
+        return self.children[self.child_offsets[i]:self.child_offsets[i + 1]]
+
+    def birth_date(self, i):
+        ''' Returns the birth date of the animal at index i or None '''
+        return datetime.date.fromordinal(int(self.birth_dates[i])) if self.birth_dates[i] else None
+
+    def ids_of(self, indexes):
+        ''' Maps dense indexes back to Animal ids '''
+        return [self.ids[i] for i in indexes]
+
+    def missing_parents(self, children=None):
+        ''' Returns (sire_ids, dam_ids): parent ids referenced by animals, or only by the given set of child ids, but
+        not present in the table '''
+        missing_sire_ids = set(sire_id for animal_id, sire_id, sire in zip(self.ids, self.sire_ids, self.sires)
+                               if sire_id and sire == NO_INDEX and (children is None or animal_id in children))
+        missing_dam_ids = set(dam_id for animal_id, dam_id, dam in zip(self.ids, self.dam_ids, self.dams)
+                              if dam_id and dam == NO_INDEX and (children is None or animal_id in children))
+        return (sorted(missing_sire_ids), sorted(missing_dam_ids))
+
+    def validate(self, male, female, valid_sexes, default_sex):
+        ''' Checks every animal in a single pass. Returns (problems, corrections).
+
+        problems maps a check name to the sorted ids it flags: self_parents and duplicate_parents (sire and dam are the
+        same animal) name the child, male_females, female_males and invalid_sexes (NULL included) name the parent or
+        animal, sire_and_dam names parents recorded in both roles, missing_sires and missing_dams name the absent parent
+        ids and born_before_parents names children born before a parent.
+        corrections holds the fixes: 'parents' maps an index to its repaired (sire_id, dam_id), 'sexes' maps an index to
+        its corrected sex, with default_sex used when no single parent role implies one, and 'dummy_sires' and 'dummy_dams' list
+        the parent ids to insert. Parent references dropped by the parents corrections are ignored by the other checks '''
+        count = len(self.ids)
+        problems = dict((name, []) for name in ('self_parents', 'duplicate_parents', 'male_females', 'female_males',
+                                                'sire_and_dam', 'invalid_sexes', 'missing_sires', 'missing_dams',
+                                                'born_before_parents'))
+        parent_corrections = {}
+        roles = bytearray(count)
+        missing_sire_ids = set()
+        missing_dam_ids = set()
+        sexes = self.sexes
+        birth_dates = self.birth_dates
+        for i in range(count):
+            sire_id = self.sire_ids[i]
+            dam_id = self.dam_ids[i]
+            sire = self.sires[i]
+            dam = self.dams[i]
+            if sire == i or dam == i:
+                problems['self_parents'].append(self.ids[i])
+                if sire == i:
+                    sire_id, sire = 0, NO_INDEX
+                if dam == i:
+                    dam_id, dam = 0, NO_INDEX
+            if sire_id and sire_id == dam_id:
+                problems['duplicate_parents'].append(self.ids[i])
+                # Keep whichever role agrees with the parent's recorded sex, or neither if that is unknown
+                parent_sex = sexes[sire] if sire != NO_INDEX else NULL_VALUE
+                if parent_sex != male:
+                    sire_id, sire = 0, NO_INDEX
+                if parent_sex != female:
+                    dam_id, dam = 0, NO_INDEX
+            if sire_id != self.sire_ids[i] or dam_id != self.dam_ids[i]:
+                parent_corrections[i] = (sire_id or None, dam_id or None)
+            if sire != NO_INDEX:
+                roles[sire] |= 1
+            elif sire_id:
+                missing_sire_ids.add(sire_id)
+            if dam != NO_INDEX:
+                roles[dam] |= 2
+            elif dam_id:
+                missing_dam_ids.add(dam_id)
+            if birth_dates[i] and any(parent != NO_INDEX and birth_dates[i] < birth_dates[parent] for parent in (sire, dam)):
+                problems['born_before_parents'].append(self.ids[i])
+        sex_corrections = {}
+        for i in range(count):
+            if roles[i] == 3:
+                # No sex fits both roles, so these are reported but never flipped back and forth by repeated fixes
+                problems['sire_and_dam'].append(self.ids[i])
+            if sexes[i] not in valid_sexes:
+                problems['invalid_sexes'].append(self.ids[i])
+                sex_corrections[i] = male if roles[i] == 1 else female if roles[i] == 2 else default_sex
+            elif roles[i] == 2 and sexes[i] == male:
+                problems['male_females'].append(self.ids[i])
+                sex_corrections[i] = female
+            elif roles[i] == 1 and sexes[i] == female:
+                problems['female_males'].append(self.ids[i])
+                sex_corrections[i] = male
+        problems['missing_sires'] = list(missing_sire_ids)
+        problems['missing_dams'] = list(missing_dam_ids)
+        for ids in problems.values():
+            ids.sort()
+        corrections = {'parents': parent_corrections,
+                       'sexes': sex_corrections,
+                       'dummy_sires': problems['missing_sires'],
+                       # An id referenced both as a sire and as a dam only gets the dummy sire
+                       'dummy_dams': sorted(missing_dam_ids.difference(missing_sire_ids))}
+        return (problems, corrections)
+
+    def components(self):
+        ''' Labels connected components over sire and dam edges with an array-based union-find (union by size, path
+        halving). Returns (roots, sizes): the root index of every animal and, at each root index, its component size '''
+        count = len(self.ids)
+        roots = array('i', range(count))
+        sizes = array('i', [1]) * count
+        for parents in (self.sires, self.dams):
+            for child, parent in enumerate(parents):
+                if parent == NO_INDEX:
+                    continue
+                a = child
+                while roots[a] != a:
+                    roots[a] = roots[roots[a]]
+                    a = roots[a]
+                b = parent
+                while roots[b] != b:
+                    roots[b] = roots[roots[b]]
+                    b = roots[b]
+                if a == b:
+                    continue
+                if sizes[a] < sizes[b]:
+                    a, b = b, a
+                roots[b] = a
+                sizes[a] += sizes[b]
+        for i in range(count):
+            root = roots[i]
+            while roots[root] != root:
+                root = roots[root]
+            roots[i] = root
+        return (roots, sizes)
+
+    def topological_order(self):
+        ''' Orders animal indexes ancestors-first, assigning every animal its generation number (0 for founders, one
+        more than the deepest parent otherwise). Returns (order, generations) arrays. Raises ValueError naming the
+        Animals on parentage cycles if the pedigree is not acyclic '''
+        order, generations, cycles = self.order_excluding_cycles()
+        if cycles:
+            cycle_ids = self.ids_of(cycles)
+            affected = sum(self.descendant_closure(cycles))
+            raise ValueError('Pedigree contains parentage cycles through %d Animals (%d Animals affected): %s' %
+                             (len(cycle_ids), affected, ', '.join(str(animal_id) for animal_id in sorted(cycle_ids))))
+        return (order, generations)
+
+    def order_excluding_cycles(self):
+        ''' Orders animal indexes ancestors-first with Kahn's algorithm, leaving out the animals on parentage cycles.
+        Descendants of a cycle are ordered as if their parents on it were unknown. Returns (order, generations, cycles)
+        where cycles lists the indexes left out, computed once per graph '''
+        if self.ordering is not None:
+            return self.ordering + (self.cycles,)
+        count = len(self.ids)
+        pending = array('b', [0]) * count
+        generations = array('i', [0]) * count
+        order = array('i')
+        for i in range(count):
+            pending[i] = (self.sires[i] != NO_INDEX) + (self.dams[i] != NO_INDEX)
+            if not pending[i]:
+                order.append(i)
+        head = 0
+        cycles = array('i')
+        while True:
+            while head < len(order):
+                i = order[head]
+                head += 1
+                generation = generations[i] + 1
+                for child in self.children[self.child_offsets[i]:self.child_offsets[i + 1]]:
+                    if generations[child] < generation:
+                        generations[child] = generation
+                    pending[child] -= 1
+                    if not pending[child]:
+                        order.append(child)
+            if len(order) + len(cycles) == count:
+                break
+            # Kahn's algorithm stalled on cycles: drop their members and release the children waiting on them
+            cycles = array('i', self.cycle_members(pending))
+            for i in cycles:
+                pending[i] = 0
+            for i in cycles:
+                for child in self.children_of(i):
+                    if pending[child]:
+                        pending[child] -= 1
+                        if not pending[child]:
+                            order.append(child)
+        self.ordering = (order, generations)
+        self.cycles = cycles
+        return (order, generations, cycles)
+
+    def cycle_members(self, pending):
+        ''' Returns sorted indexes of the animals on parentage cycles, given the pending parent counts left by Kahn's
+        algorithm. Animals that merely descend from a cycle are pruned leaves-first, then the cycles are the strongly
+        connected components of what remains (Tarjan's algorithm without recursion) with more than one animal or a
+        self reference. Animals between two cycles are thereby not reported '''
+        remaining = bytearray(1 if waiting else 0 for waiting in pending)
+        live_children = array('i', [0]) * len(self.ids)
+        for i in range(len(self.ids)):
+            if remaining[i]:
+                live_children[i] = sum(1 for child in self.children_of(i) if remaining[child])
+        stack = [i for i in range(len(self.ids)) if remaining[i] and not live_children[i]]
+        while stack:
+            i = stack.pop()
+            remaining[i] = 0
+            for parent in (self.sires[i], self.dams[i]):
+                if parent != NO_INDEX and remaining[parent]:
+                    live_children[parent] -= 1
+                    if not live_children[parent]:
+                        stack.append(parent)
+        numbers = {}
+        lowest = {}
+        visited = []
+        on_stack = set()
+        members = []
+        for root in (i for i in range(len(self.ids)) if remaining[i]):
+            if root in numbers:
+                continue
+            work = [(root, 0)]
+            while work:
+                i, edge = work[-1]
+                if not edge:
+                    numbers[i] = lowest[i] = len(numbers)
+                    visited.append(i)
+                    on_stack.add(i)
+                parents = (self.sires[i], self.dams[i])
+                descended = False
+                while edge < 2:
+                    parent = parents[edge]
+                    edge += 1
+                    if parent == NO_INDEX or not remaining[parent]:
+                        continue
+                    if parent not in numbers:
+                        work[-1] = (i, edge)
+                        work.append((parent, 0))
+                        descended = True
+                        break
+                    if parent in on_stack:
+                        lowest[i] = min(lowest[i], numbers[parent])
+                if descended:
+                    continue
+                work.pop()
+                if work:
+                    lowest[work[-1][0]] = min(lowest[work[-1][0]], lowest[i])
+                if lowest[i] == numbers[i]:
+                    component = []
+                    while True:
+                        member = visited.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == i:
+                            break
+                    if len(component) > 1 or i in parents:
+                        members.extend(component)
+        return sorted(members)
+
+    def rows(self, indexes, left_out=None):
+        ''' Yields a GenerateRow for each of the given indexes. Parents flagged in the left_out mask are written as unknown '''
+        for i in indexes:
+            sire_left_out = left_out is not None and self.sires[i] != NO_INDEX and left_out[self.sires[i]]
+            dam_left_out = left_out is not None and self.dams[i] != NO_INDEX and left_out[self.dams[i]]
+            yield GenerateRow(self.ids[i],
+                              None if sire_left_out else self.sire_ids[i] or None,
+                              None if dam_left_out else self.dam_ids[i] or None,
+                              self.birth_date(i),
+                              None if self.sexes[i] == NULL_VALUE else self.sexes[i],
+                              None if self.groups[i] == NULL_VALUE else self.groups[i],
+                              bool(self.flags[i] & BASE_POPULATION_MEMBER))
+
+    def parents_left_out(self, indexes, left_out):
+        ''' Returns the number of parent references of the given indexes pointing at animals flagged in left_out '''
+        return sum(1 for i in indexes for parent in (self.sires[i], self.dams[i]) if parent != NO_INDEX and left_out[parent])
+
+    def selection(self, groups=None):
+        ''' Returns a mask of the animals in the given groups, base population members and all of their ancestors '''
+        if groups is None:
+            return bytearray(b'\x01') * len(self.ids)
+        groups = set(groups)
+        return self.ancestor_closure(i for i in range(len(self.ids))
+                                     if self.groups[i] in groups or self.flags[i] & BASE_POPULATION_MEMBER)
+
+    def ancestor_closure(self, seeds):
+        ''' Returns a bytearray mask of the seed indexes and all of their ancestors present in the table '''
+        mask = bytearray(len(self.ids))
+        stack = list(seeds)
+        while stack:
+            i = stack.pop()
+            if mask[i]:
+                continue
+            mask[i] = 1
+            if self.sires[i] != NO_INDEX:
+                stack.append(self.sires[i])
+            if self.dams[i] != NO_INDEX:
+                stack.append(self.dams[i])
+        return mask
+
+    def descendant_closure(self, seeds):
+        ''' Returns a bytearray mask of the seed indexes and all of their descendants '''
+        mask = bytearray(len(self.ids))
+        stack = list(seeds)
+        while stack:
+            i = stack.pop()
+            if mask[i]:
+                continue
+            mask[i] = 1
+            stack.extend(self.children_of(i))
+        return mask
@@ -0,0 +1,104 @@
+import numpy
+
+__author__ = 'adamj'
+
+def inbreeding_coefficients(animals, sires, dams, generations, block_elements=1 << 23):
+    ''' Computes inbreeding coefficients with Colleau's (2002) indirect method, one generation at a time.
+
+    animals lists the graph indexes to compute, which must include all of their ancestors. sires and dams hold parent
+    graph indexes (negative when unknown) and generations the generation number of every graph index. The coefficient
+    of an animal is half the relationship between its parents. The relationships A[:, p] = T D T' e_p for a block of
+    parents p are obtained with one backward sweep over the ancestors of p and one forward sweep over the ancestors of
+    p and its mates, so the cost grows with the depth of the ancestry rather than with the size of the pedigree.
+    Returns a float64 array of coefficients aligned with animals. '''
+    animals = numpy.asarray(animals, dtype=numpy.int64)
+    count = len(animals)
+    if not count:
+        return numpy.zeros(0)
+    sires = numpy.asarray(sires, dtype=numpy.int64)
+    dams = numpy.asarray(dams, dtype=numpy.int64)
+    level = numpy.asarray(generations, dtype=numpy.int64)[animals]
+    # Renumber to 1..count sorted by generation so every generation is a contiguous block; 0 is the unknown parent
+    by_level = numpy.argsort(level, kind='mergesort')
+    position = numpy.zeros(len(sires), dtype=numpy.int64)
+    position[animals[by_level]] = numpy.arange(1, count + 1)
+    ordered = animals[by_level]
+    sire = numpy.zeros(count + 1, dtype=numpy.int64)
+    dam = numpy.zeros(count + 1, dtype=numpy.int64)
+    sire[1:] = numpy.where(sires[ordered] >= 0, position[sires[ordered]], 0)
+    dam[1:] = numpy.where(dams[ordered] >= 0, position[dams[ordered]], 0)
+    level_starts = numpy.searchsorted(level[by_level], numpy.arange(level.max() + 2)) + 1
+    coefficients = numpy.zeros(count + 1)
+    coefficients[0] = -1.0
+    variances = numpy.zeros(count + 1)
+    mask = numpy.zeros(count + 1, dtype=bool)
+    for generation, (start, end) in enumerate(zip(level_starts[:-1], level_starts[1:])):
+        s = sire[start:end]
+        d = dam[start:end]
+        both = numpy.flatnonzero((s > 0) & (d > 0))
+        if len(both):
+            s = s[both]
+            d = d[both]
+            # Sweep over whichever parent role has fewer distinct animals in this generation
+            if len(numpy.unique(d)) < len(numpy.unique(s)):
+                s, d = d, s
+            keys, columns = numpy.unique(s, return_inverse=True)
+            relationships = block_relationships(keys, d, columns, sire, dam, variances, level_starts[:generation + 1],
+                                                mask, block_elements)
+            coefficients[start + both] = 0.5 * relationships
+        # Mendelian sampling variances, 0.5 - 0.25 (Fs + Fd) with F = -1 standing for unknown parents
+        variances[start:end] = 0.5 - 0.25 * (coefficients[sire[start:end]] + coefficients[dam[start:end]])
+    result = numpy.zeros(count)
+    result[by_level] = coefficients[1:]
+    return result
+
+def ancestor_closure(seeds, sire, dam, level_starts, mask):
+    ''' Returns the sorted positions of the seeds and all of their ancestors, always including the unknown parent 0.
+    level_starts bounds the generations older than the seeds and mask is a scratch array at least that long '''
+    mask[:level_starts[-1]] = False
+    mask[seeds] = True
+    for start, end in reversed(zip(level_starts[1:-1], level_starts[2:])):
+        members = start + numpy.flatnonzero(mask[start:end])
+        mask[sire[members]] = True
+        mask[dam[members]] = True
+    mask[0] = True
+    return numpy.flatnonzero(mask[:level_starts[-1]])
+
+def block_relationships(keys, mates, columns, sire, dam, variances, level_starts, mask, block_elements):
+    ''' Returns A[keys[columns], mates] for every mating, sweeping a dense block with a column per key over only the
+    ancestors of the keys and their mates. Blocks whose sweep would exceed block_elements are split in halves '''
+    nodes = ancestor_closure(numpy.concatenate((keys, mates)), sire, dam, level_starts, mask)
+    if len(nodes) * len(keys) > block_elements and len(keys) > 1:
+        half = len(keys) // 2
+        first = columns < half
+        relationships = numpy.empty(len(mates))
+        relationships[first] = block_relationships(keys[:half], mates[first], columns[first], sire, dam, variances,
+                                                   level_starts, mask, block_elements)
+        relationships[~first] = block_relationships(keys[half:], mates[~first], columns[~first] - half, sire, dam,
+                                                    variances, level_starts, mask, block_elements)
+        return relationships
+    # Work on local row numbers within the closure, which keeps the generation order of the positions
+    key_rows = numpy.searchsorted(nodes, ancestor_closure(keys, sire, dam, level_starts, mask))
+    local_sire = numpy.searchsorted(nodes, sire[nodes])
+    local_dam = numpy.searchsorted(nodes, dam[nodes])
+    bounds = numpy.searchsorted(nodes, level_starts)
+    key_bounds = numpy.searchsorted(key_rows, bounds)
+    sweep = numpy.zeros((len(nodes), len(keys)))
+    sweep[numpy.searchsorted(nodes, keys), numpy.arange(len(keys))] = 1.0
+    # u = T' x: push contributions from the youngest generation holding a key down to the founders. Only the ancestors
+    # of the keys carry contributions, so only their parent edges are visited, grouped by parent for a single reduceat
+    for key_start, key_end in reversed(zip(key_bounds[1:-1], key_bounds[2:])):
+        if key_start == key_end:
+            continue
+        children = key_rows[key_start:key_end]
+        parents = numpy.concatenate((local_sire[children], local_dam[children]))
+        edge_order = numpy.argsort(parents, kind='mergesort')
+        parents = parents[edge_order]
+        firsts = numpy.flatnonzero(numpy.concatenate(([True], parents[1:] != parents[:-1])))
+        sweep[parents[firsts]] += 0.5 * numpy.add.reduceat(sweep[numpy.concatenate((children, children))[edge_order]], firsts, axis=0)
+    # w = D u, with nothing passed on through unknown parents, then v = T w from the founders up to the mates
+    sweep[0] = 0.0
+    sweep *= variances[nodes, numpy.newaxis]
+    for start, end in zip(bounds[1:-1], bounds[2:]):
+        sweep[start:end] += 0.5 * (sweep[local_sire[start:end]] + sweep[local_dam[start:end]])
+    return sweep[numpy.searchsorted(nodes, mates), columns]
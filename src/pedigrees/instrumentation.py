@@ -0,0 +1,225 @@
+import csv
+import datetime
+import json
+import logging
+import sys
+import timeit
+from contextlib import contextmanager
+from sqlalchemy import event
+try:
+    import resource
+except ImportError:
+    resource = None
+
+__author__ = 'adamj'
+
+# Number of ids written to the log by log_ids when they are not streamed to an id file
+DEFAULT_ID_LIMIT = 20
+
+class Phase(object):
+    ''' Timings, SQL statistics and row counts of one phase of a run. The resident set size high-water mark is only
+    tracked per process, so a phase records the process peak when it ended and how much it raised that peak '''
+
+    def __init__(self, name):
+        self.name = name
+        self.started = timeit.default_timer()
+        self.started_peak_memory_mb = peak_memory_mb()
+        self.seconds = None
+        self.statements = 0
+        self.statement_seconds = 0.0
+        self.rows_read = 0
+        self.rows_written = 0
+        self.process_peak_memory_mb = None
+        self.peak_memory_growth_mb = None
+        self.worker_peak_memory_mb = None
+        self.phases = []
+
+    def as_dict(self):
+        return {'name': self.name,
+                'seconds': self.seconds,
+                'statements': self.statements,
+                'statement_seconds': self.statement_seconds,
+                'rows_read': self.rows_read,
+                'rows_written': self.rows_written,
+                'process_peak_memory_mb': self.process_peak_memory_mb,
+                'peak_memory_growth_mb': self.peak_memory_growth_mb,
+                'worker_peak_memory_mb': self.worker_peak_memory_mb,
+                'phases': [phase.as_dict() for phase in self.phases]}
+
+class RunReport(object):
+    ''' Collects nested phases of one invocation. Statement and row counts are added to every open phase, so each
+    phase includes the totals of its children '''
+
+    def __init__(self, mode, id_file=None, id_limit=DEFAULT_ID_LIMIT):
+        self.mode = mode
+        self.started_at = datetime.datetime.now()
+        self.root = Phase(mode)
+        self.stack = [self.root]
+        self.id_file = id_file
+        self.id_limit = id_limit
+        self.id_counts = {}
+        self.id_writer = None
+        self.id_stream = None
+
+    @contextmanager
+    def phase(self, name):
+        phase = Phase(name)
+        self.stack[-1].phases.append(phase)
+        self.stack.append(phase)
+        try:
+            yield phase
+        finally:
+            self.stack.pop()
+            finish_phase(phase)
+
+    def record_statement(self, seconds, rows_written):
+        for phase in self.stack:
+            phase.statements += 1
+            phase.statement_seconds += seconds
+            phase.rows_written += rows_written
+
+    def record_rows_read(self, count):
+        for phase in self.stack:
+            phase.rows_read += count
+
+    def merge_worker(self, report):
+        ''' Adds the statement, row and id counts of a worker process's report to every open phase '''
+        worker = report['run']
+        for phase in self.stack:
+            phase.statements += worker['statements']
+            phase.statement_seconds += worker['statement_seconds']
+            phase.rows_read += worker['rows_read']
+            phase.rows_written += worker['rows_written']
+            if worker['process_peak_memory_mb'] is not None:
+                phase.worker_peak_memory_mb = max(phase.worker_peak_memory_mb or 0, worker['process_peak_memory_mb'])
+        for label, count in report['id_counts'].items():
+            self.id_counts[label] = self.id_counts.get(label, 0) + count
+
+    def log_ids(self, label, ids):
+        ''' Logs a capped sample of ids, streaming the full listing to the id file when one is set '''
+        ids = list(ids)
+        self.id_counts[label] = self.id_counts.get(label, 0) + len(ids)
+        if self.id_file:
+            if self.id_writer is None:
+                self.id_stream = open(self.id_file, 'wb')
+                self.id_writer = csv.writer(self.id_stream)
+                self.id_writer.writerow(['label', 'id'])
+            self.id_writer.writerows([label, animal_id] for animal_id in ids)
+            logging.info('%s: %d ids written to %s' % (label, len(ids), self.id_file))
+        else:
+            log_capped_ids(label, ids, self.id_limit)
+
+    def finish(self):
+        finish_phase(self.root)
+        if self.id_stream is not None:
+            self.id_stream.close()
+        return self.as_dict()
+
+    def as_dict(self):
+        return {'mode': self.mode,
+                'started_at': self.started_at.isoformat(),
+                'id_file': self.id_file,
+                'id_counts': self.id_counts,
+                'run': self.root.as_dict()}
+
+def finish_phase(phase):
+    phase.seconds = timeit.default_timer() - phase.started
+    phase.process_peak_memory_mb = peak_memory_mb()
+    if phase.started_peak_memory_mb is not None:
+        phase.peak_memory_growth_mb = phase.process_peak_memory_mb - phase.started_peak_memory_mb
+
+def peak_memory_mb():
+    ''' Returns the peak resident set size of this process in MB, or None where the resource module is unavailable '''
+    if resource is None:
+        return None
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux and the BSDs
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1048576.0 if sys.platform == 'darwin' else 1024.0)
+
+def log_capped_ids(label, ids, limit):
+    shown = ','.join([str(animal_id) for animal_id in ids[:limit]])
+    logging.info('%s: %s%s' % (label, shown, ' and %d more' % (len(ids) - limit) if len(ids) > limit else ''))
+
+# The RunReport of the current invocation, if one was started
+current_report = None
+
+def start_run(mode, id_file=None, id_limit=DEFAULT_ID_LIMIT):
+    ''' Starts collecting a RunReport for this invocation '''
+    global current_report
+    current_report = RunReport(mode, id_file, id_limit)
+    return current_report
+
+def finish_run(report_file=None):
+    ''' Finishes the current RunReport, writing it as JSON to report_file when given. Returns the report dict '''
+    global current_report
+    if current_report is None:
+        return None
+    report = current_report.finish()
+    current_report = None
+    if report_file:
+        with open(report_file, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+        logging.info('Wrote Run Report to %s' % report_file)
+    return report
+
+@contextmanager
+def phase(name):
+    ''' Times a named phase of the current run, doing nothing when no run was started '''
+    if current_report is None:
+        yield None
+    else:
+        with current_report.phase(name) as current_phase:
+            yield current_phase
+
+def record_rows_read(count):
+    if current_report is not None:
+        current_report.record_rows_read(count)
+
+def run_in_worker(function, *args):
+    ''' Runs function in a worker process under a report of its own. Returns (result, report dict) for merge_worker.
+    Worker id listings are logged as capped samples rather than streamed to the id file of the parent '''
+    global current_report
+    # A forked worker inherits the parent's report and its id file. Keeping a reference stops the copy from being
+    # collected, which would flush the parent's buffered ids into the file a second time
+    inherited_report = current_report
+    start_run(function.__name__)
+    try:
+        result = function(*args)
+    finally:
+        report = finish_run()
+        current_report = inherited_report
+    return (result, report)
+
+def merge_worker(report):
+    ''' Adds the counts of a report returned by run_in_worker to the current run '''
+    if current_report is not None and report is not None:
+        current_report.merge_worker(report)
+
+def log_ids(label, ids):
+    ''' Logs an id listing through the current run, or a capped sample of it when no run was started '''
+    if current_report is not None:
+        current_report.log_ids(label, ids)
+    else:
+        log_capped_ids(label, list(ids), DEFAULT_ID_LIMIT)
+
+def instrument_engine(engine):
+    ''' Records the count, duration and written rows of every statement the engine executes in the current run '''
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault('statement_started', []).append(timeit.default_timer())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        seconds = timeit.default_timer() - connection.info['statement_started'].pop()
+        if current_report is not None:
+            written = cursor.rowcount if cursor.rowcount > 0 and statement.lstrip()[:6].upper() in ('INSERT', 'UPDATE', 'DELETE') else 0
+            current_report.record_statement(seconds, written)
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        # after_cursor_execute does not fire for a failed statement, so its start time is dropped here instead of
+        # pairing with the next statement on the pooled connection
+        started = context.connection.info.get('statement_started') if context.connection is not None else None
+        if started:
+            seconds = timeit.default_timer() - started.pop()
+            if current_report is not None:
+                current_report.record_statement(seconds, 0)
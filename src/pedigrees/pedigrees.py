@@ -3,11 +3,18 @@ import os
 import sys
 import csv
 import datetime
+import hashlib
+import json
+import multiprocessing
 from contextlib import closing
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, aliased
-from sqlalchemy import Column, Integer, Date, Boolean, String, create_engine, distinct, not_
-from dbfpy import dbf
+from sqlalchemy import Column, Integer, Date, Boolean, String, Float, create_engine, inspect, not_, select, bindparam, case, exists, true
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine.url import make_url
+from dbfwriter import EndogDbfWriter
+from graph import PedigreeGraph, DUMMY_ANIMAL, NULL_VALUE
+from instrumentation import instrument_engine, phase, record_rows_read, log_ids, run_in_worker, merge_worker
 
 __author__ = 'adamj'
 
@@ -17,26 +24,93 @@ class Animal(Base):
     __tablename__ = 'animals'
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    sire_id = Column(Integer, nullable=True, default=None)
-    dam_id = Column(Integer, nullable=True, default=None)
-    birth_date = Column(Date, nullable=True, default=None)
-    group = Column(Integer, nullable=True, default=-1)
+    sire_id = Column(Integer, nullable=True, default=None, index=True)
+    dam_id = Column(Integer, nullable=True, default=None, index=True)
+    birth_date = Column(Date, nullable=True, default=None, index=True)
+    group = Column(Integer, nullable=True, default=-1, index=True)
     sex = Column(Integer, nullable=True, default=-1)
-    base_population_member = Column(Boolean, nullable=False, default=False)
+    base_population_member = Column(Boolean, nullable=False, default=False, index=True)
     dummy_animal = Column(Boolean, nullable=False, default=False)
     notes = Column(String, nullable=True, default=None)
+    inbreeding = Column(Float, nullable=True, default=None)
+    row_hash = Column(String(32), nullable=True, default=None)
+
+class TableVersion(Base):
+    __tablename__ = 'table_versions'
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+class DirtyAnimal(Base):
+    __tablename__ = 'dirty_animals'
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+
+# Settings, engines and session classes already set up in this process, keyed by settings file path
+contexts = {}
+# PedigreeGraphs already loaded in this process, keyed by engine
+graphs = {}
 
 def init(settings_file):
-    ''' Performs common init '''
-    settings = load_settings(settings_file)
-    engine = create_engine(settings['connection_string'])
-    session_class = sessionmaker(bind=engine)
-    return (settings, engine, session_class)
+    ''' Performs common init, reusing the settings, engine and connection pool of earlier calls in this process '''
+    key = os.path.abspath(settings_file)
+    if key not in contexts:
+        settings = load_settings(settings_file)
+        engine = create_engine(settings['connection_string'], **engine_options(settings))
+        instrument_engine(engine)
+        session_class = sessionmaker(bind=engine)
+        contexts[key] = (settings, engine, session_class)
+    return contexts[key]
+
+def engine_options(settings):
+    ''' Returns the create_engine keyword arguments from the engine_options setting. PostgreSQL connections through
+    psycopg2 default to sending executemany batches as multi-row statements rather than one round trip per row '''
+    options = dict(settings.get('engine_options') or {})
+    url = make_url(settings['connection_string'])
+    if url.get_backend_name() == 'postgresql' and url.get_driver_name() == 'psycopg2':
+        options.setdefault('executemany_mode', 'values')
+    return options
 
 def init_database(settings_file):
     logging.info('Performing Database Init')
     settings, engine, session_class = init(settings_file)
     Animal.metadata.create_all(engine)
+    upgrade_database(engine)
+    analyze_animals(engine)
+
+def upgrade_database(engine):
+    ''' Adds columns and indexes introduced since an existing animals table was created '''
+    existing_columns = set(column['name'] for column in inspect(engine).get_columns(Animal.__tablename__))
+    for column in Animal.__table__.columns:
+        if column.name not in existing_columns:
+            logging.info('Adding column %s to %s' % (column.name, Animal.__tablename__))
+            engine.execute('ALTER TABLE %s ADD COLUMN %s %s' % (Animal.__tablename__,
+                                                               engine.dialect.identifier_preparer.quote(column.name),
+                                                               column.type.compile(engine.dialect)))
+    create_animal_indexes(engine)
+
+def create_animal_indexes(bind):
+    ''' Creates the indexes of the animals table that do not exist yet, using an engine or a connection '''
+    existing_indexes = set(index['name'] for index in inspect(bind).get_indexes(Animal.__tablename__))
+    for index in sorted(Animal.__table__.indexes, key=lambda index: index.name):
+        if index.name not in existing_indexes:
+            logging.info('Creating index %s on %s' % (index.name, Animal.__tablename__))
+            index.create(bind)
+
+def drop_animal_indexes(bind):
+    ''' Drops the indexes of the animals table, so a bulk load does not maintain them row by row '''
+    existing_indexes = set(index['name'] for index in inspect(bind).get_indexes(Animal.__tablename__))
+    for index in sorted(Animal.__table__.indexes, key=lambda index: index.name):
+        if index.name in existing_indexes:
+            logging.info('Dropping index %s on %s' % (index.name, Animal.__tablename__))
+            index.drop(bind)
+
+def analyze_animals(engine):
+    ''' Refreshes the planner statistics of the animals table '''
+    if engine.dialect.name in ('postgresql', 'sqlite'):
+        engine.execute('ANALYZE %s' % Animal.__tablename__)
+    elif engine.dialect.name == 'mysql':
+        engine.execute('ANALYZE TABLE %s' % Animal.__tablename__)
 
 def load_settings(settings_file):
     ''' Loads the given Settings Python script, returning a dict containing values '''
@@ -46,50 +120,272 @@ def load_settings(settings_file):
     execfile(settings_file, settings)
     return settings
 
+def load_graph(session, snapshot_directory=None):
+    ''' Returns the cached PedigreeGraph for the session's engine. Otherwise it is memory-mapped from snapshot_directory
+    when that holds a snapshot of the current table version, or loaded from a single scan of the animals table '''
+    engine = session.get_bind()
+    if engine in graphs:
+        return graphs[engine]
+    graph = None
+    with phase('load_graph'):
+        if snapshot_directory:
+            from snapshots import read_snapshot
+            graph = read_snapshot(snapshot_directory, get_table_version(engine))
+            if graph is None:
+                logging.info('No current snapshot in %s, reading the animals table' % snapshot_directory)
+            else:
+                logging.info('Mapped Pedigree Graph of %d Animals from %s' % (len(graph), snapshot_directory))
+        if graph is None:
+            query = session.query(Animal.id, Animal.sire_id, Animal.dam_id, Animal.sex, Animal.group, Animal.birth_date,
+                                  Animal.base_population_member, Animal.dummy_animal)
+            graph = PedigreeGraph.from_rows(query.yield_per(10000))
+            logging.info('Loaded Pedigree Graph of %d Animals' % len(graph))
+        record_rows_read(len(graph))
+    graphs[engine] = graph
+    return graph
+
+def invalidate_graph(engine):
+    ''' Drops the cached PedigreeGraph and bumps the table version once a mode has changed the animals table. Modes
+    only call it when they changed rows, so runs that change nothing keep the cached graph and current snapshots '''
+    graphs.pop(engine, None)
+    bump_table_version(engine)
+
+def get_table_version(engine):
+    ''' Returns the version of the animals table, which every mode changing the table bumps '''
+    TableVersion.__table__.create(engine, checkfirst=True)
+    table = TableVersion.__table__
+    return engine.execute(select([table.c.version]).where(table.c.name == Animal.__tablename__)).scalar() or 0
+
+def bump_table_version(engine):
+    ''' Increments the version of the animals table, so snapshots taken before the change are no longer used '''
+    TableVersion.__table__.create(engine, checkfirst=True)
+    table = TableVersion.__table__
+    with engine.begin() as connection:
+        if not connection.execute(table.update().where(table.c.name == Animal.__tablename__).values(version=table.c.version + 1)).rowcount:
+            connection.execute(table.insert(), name=Animal.__tablename__, version=1)
+
+def compile_column_plan(settings, header):
+    ''' Compiles the column settings against a CSV header into a list of (index, attribute, coercer) tuples and the id attribute '''
+    column_names = set(settings.get('column_names_list', []))
+    column_value_coercion_map = settings.get('column_value_coercion_map', {})
+    column_name_coercion_map = settings.get('column_name_coercion_map', {})
+    id_attribute = None
+    plan = []
+    for index, column in enumerate(header):
+        attribute = column_name_coercion_map.get(column)
+        if column in column_names and attribute is not None:
+            plan.append((index, attribute, column_value_coercion_map.get(column)))
+            if column == settings.get('id_column_name'):
+                id_attribute = attribute
+    return (plan, id_attribute)
+
+def iter_csv(settings, input_file):
+    ''' Opens an input CSV and yields (row_id, row_dict) pairs one row at a time '''
+    with open(input_file, 'r') as input:
+        reader = csv.reader(input)
+        header = next(reader)
+        plan, id_attribute = compile_column_plan(settings, header)
+        width = len(header)
+        auto_id = -1
+        for row in reader:
+            if len(row) < width:
+                # Short rows only carry the leading columns, exactly like zip(header, row) would
+                row_plan = [step for step in plan if step[0] < len(row)]
+            else:
+                row_plan = plan
+            row_dict = {}
+            for index, attribute, coercer in row_plan:
+                row_dict[attribute] = coercer(row[index]) if coercer is not None else row[index]
+            if id_attribute is not None and id_attribute in row_dict:
+                yield row_dict[id_attribute], row_dict
+            else:
+                yield auto_id, row_dict
+                auto_id -= 1
+
 def load_csv(settings, input_file):
     ''' Opens and input CSV and parses the contents a row dict '''
     logging.info('Loading CSV data from %s' % input_file)
-    column_names_list = settings.get('column_names_list', [])
-    column_value_coercion_map = settings.get('column_value_coercion_map', {})
-    column_name_coercion_map = settings.get('column_name_coercion_map', {})
-    reader = csv.reader(open(input_file, 'r'))
-    header = reader.next()
-    rows = {}
-    auto_id = -1
-    for row in reader:
-        zipped_row = zip(header, row)
-        row_id_value = auto_id
-        row_dict = {}
-        for column, value in zipped_row:
-            if column in column_names_list and column_name_coercion_map.get(column) is not None:
-                value = column_value_coercion_map.get(column, lambda v: v)(value)
-                row_dict[column_name_coercion_map[column]] = value
-                if column == settings.get('id_column_name'):
-                    row_id_value = value
-        rows[row_id_value] = row_dict
-        if row_id_value == auto_id:
-            auto_id -= 1
-    return rows
-
-def import_csv(settings_file, input_file, update=True):
-    ''' Opens an input CSV and parses the contents into Records '''
+    return dict(iter_csv(settings, input_file))
+
+def chunked(iterable, chunk_size):
+    ''' Yields lists of at most chunk_size items from the given iterable '''
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# Largest number of bind parameters drivers such as pg8000 accept in a single statement
+MAX_BIND_PARAMETERS = 32767
+# Lower limits of some databases, SQLite builds before 3.32 defaulting SQLITE_MAX_VARIABLE_NUMBER to 999
+DIALECT_BIND_PARAMETERS = {'sqlite': 999}
+
+def max_bind_parameters(dialect):
+    ''' Returns the largest number of bind parameters a single statement may carry on the given dialect '''
+    return DIALECT_BIND_PARAMETERS.get(dialect.name, MAX_BIND_PARAMETERS)
+
+def with_insert_defaults(row):
+    ''' Pads a row dict to every column of the animals table, replacing missing and None values with column defaults,
+    matching what the ORM does when inserting a new Animal. The id is only included when the row has one '''
+    values = {}
+    for column in Animal.__table__.columns:
+        if column.name in row or column.name != 'id':
+            value = row.get(column.name)
+            values[column.name] = column.default.arg if value is None and column.default is not None else value
+    return values
+
+def group_by_keys(rows):
+    ''' Splits row dicts into lists sharing the same keys, since a multi-row statement takes its columns from one row '''
+    groups = {}
+    for row in rows:
+        groups.setdefault(frozenset(row), []).append(row)
+    return groups.values()
+
+def hash_row(row):
+    ''' Returns a hex digest of a coerced CSV row dict, used to detect rows unchanged since the previous import '''
+    return hashlib.md5(repr(sorted(row.items()))).hexdigest()
+
+def upsert_animals(connection, rows, update=True, added_ids=None):
+    ''' Writes a chunk of row dicts to the animals table using set-based statements, skipping existing Animals whose
+    stored row_hash matches. When an id repeats, its last row wins: later rows of the chunk replace earlier ones, and
+    Animals in added_ids, the ids inserted by earlier chunks of the same import, are rewritten even without update.
+    New Animals are padded to every column, while updates of short rows only touch the columns they carry, so rows
+    with different columns go to separate statements. Multi-row statements and id lookups are split to stay within
+    the bind parameter limit of the dialect. Returns (added_ids, updated_ids, unchanged) where added_ids includes the
+    ids generated for rows without one '''
+    table = Animal.__table__
+    bind_parameters = max_bind_parameters(connection.dialect)
+    # Every column of the table may be rendered as a bind parameter per row, defaults included
+    rows_per_statement = bind_parameters // len(table.columns)
+    added_ids = added_ids or ()
+    keyed_rows = {}
+    unkeyed_rows = []
+    for row in rows:
+        row = dict(row, row_hash=hash_row(row))
+        if row.get('id') is None:
+            unkeyed_rows.append(dict((k, v) for k, v in row.items() if k != 'id'))
+        else:
+            keyed_rows[row['id']] = row
+    existing_hashes = {}
+    for row_ids in chunked(keyed_rows.keys(), bind_parameters):
+        existing_hashes.update(connection.execute(select([table.c.id, table.c.row_hash]).where(table.c.id.in_(row_ids))).fetchall())
+    new_rows = [with_insert_defaults(keyed_row) for row_id, keyed_row in keyed_rows.items() if row_id not in existing_hashes]
+    existing_rows = [keyed_row for row_id, keyed_row in keyed_rows.items()
+                     if row_id in existing_hashes and existing_hashes[row_id] != keyed_row['row_hash'] and (update or row_id in added_ids)]
+    if connection.dialect.name == 'postgresql':
+        # Multi-row INSERT ... ON CONFLICT statements write new and existing Animals in a few round trips
+        for insert_rows in chunked(new_rows, rows_per_statement):
+            connection.execute(postgresql.insert(table).values(insert_rows).on_conflict_do_nothing(index_elements=[table.c.id]))
+        for group_rows in group_by_keys(existing_rows):
+            for upsert_rows in chunked(group_rows, rows_per_statement):
+                statement = postgresql.insert(table).values(upsert_rows)
+                statement = statement.on_conflict_do_update(index_elements=[table.c.id],
+                                                            set_=dict((c, statement.excluded[c]) for c in upsert_rows[0] if c != 'id'))
+                connection.execute(statement)
+    else:
+        if new_rows:
+            connection.execute(table.insert(), new_rows)
+        for group_rows in group_by_keys(existing_rows):
+            connection.execute(table.update().where(table.c.id == bindparam('_id')),
+                               [dict([(k, v) for k, v in group_row.items() if k != 'id'] + [('_id', group_row['id'])]) for group_row in group_rows])
+    generated_ids = []
+    unkeyed_rows = [with_insert_defaults(unkeyed_row) for unkeyed_row in unkeyed_rows]
+    if connection.dialect.name == 'postgresql':
+        for insert_rows in chunked(unkeyed_rows, rows_per_statement):
+            generated_ids.extend(row[0] for row in connection.execute(table.insert().values(insert_rows).returning(table.c.id)))
+    else:
+        # executemany does not report generated keys, so rows without an id are inserted one at a time
+        for row in unkeyed_rows:
+            generated_ids.append(connection.execute(table.insert(), row).inserted_primary_key[0])
+    return ([new_row['id'] for new_row in new_rows] + generated_ids, [existing_row['id'] for existing_row in existing_rows],
+            len(existing_hashes) - len(existing_rows))
+
+def import_csv(settings_file, input_file, update=True, chunk_size=None, bulk_load=None):
+    ''' Streams an input CSV into the animals table as chunks of bulk inserts and upserts, writing only new and changed
+    rows. When the CSV repeats an id, the last row for it wins, as when the whole file was read into one dict, and the
+    number of repeated rows is logged. The changed Animals and all of their descendants replace the dirty set used by
+    dirty_only steps. In bulk_load mode the secondary indexes are dropped for the load, then rebuilt and the table
+    analyzed. Both happen in the load transaction, so with transactional DDL (PostgreSQL) a failed or killed load leaves
+    the indexes in place. Elsewhere, SQLite through pysqlite included, an interrupted load can leave them dropped until
+    init_database recreates them '''
     logging.info('Performing CSV Import')
     settings, engine, session_class = init(settings_file)
-    rows = load_csv(settings, input_file)
-    row_ids = set(rows.keys())
-    added = 0
-    updated = 0
+    chunk_size = chunk_size or settings.get('import_chunk_size', 2500)
+    bulk_load = settings.get('bulk_load', False) if bulk_load is None else bulk_load
+    logging.info('Streaming CSV data from %s in chunks of %d rows' % (input_file, chunk_size))
+    added_ids = set()
+    seen_ids = set()
+    duplicates = 0
+    changed_ids = []
+    unchanged = 0
+    if bulk_load and engine.dialect.name != 'postgresql':
+        logging.warning('The %s database may not roll back the indexes dropped for a bulk load. Run init_database to '
+                        'recreate them should the import be interrupted' % engine.dialect.name)
+    try:
+        with phase('write_rows'), engine.begin() as connection:
+            if bulk_load:
+                drop_animal_indexes(connection)
+            for rows in chunked((row for row_id, row in iter_csv(settings, input_file)), chunk_size):
+                record_rows_read(len(rows))
+                for row in rows:
+                    if row.get('id') is not None:
+                        if row['id'] in seen_ids:
+                            duplicates += 1
+                        seen_ids.add(row['id'])
+                chunk_added_ids, updated_ids, chunk_unchanged = upsert_animals(connection, rows, update, added_ids)
+                added_ids.update(chunk_added_ids)
+                changed_ids.extend(chunk_added_ids)
+                changed_ids.extend(updated_ids)
+                unchanged += chunk_unchanged
+            if bulk_load:
+                with phase('rebuild_indexes'):
+                    create_animal_indexes(connection)
+    except Exception:
+        if bulk_load:
+            # A no-op where the rollback already restored the indexes
+            create_animal_indexes(engine)
+        raise
+    if bulk_load:
+        with phase('rebuild_indexes'):
+            analyze_animals(engine)
+    if duplicates:
+        logging.warning('Found %d rows repeating an earlier id, kept the last row for each id' % duplicates)
+    changed_ids = set(changed_ids)
+    logging.info('Added %d Animals. Updated %d Animals. Skipped %d unchanged Animals' % (len(added_ids), len(changed_ids) - len(added_ids), unchanged))
+    if not changed_ids:
+        # Nothing was written, so the cached graph and snapshots stay current and no Animal is dirty
+        record_dirty_animals(engine, [])
+        return
+    invalidate_graph(engine)
     with closing(session_class()) as session:
-        existing_animal_ids = [a.id for a in session.query(Animal.id).all()]
-        for row_id in row_ids.difference(existing_animal_ids):
-            session.add(Animal(**rows[row_id]))
-            added +=1
-        if update:
-            for row_id in row_ids.intersection(existing_animal_ids):
-                session.query(Animal).filter(Animal.id == row_id).update(rows[row_id])
-                updated +=1
-        session.commit()
-        logging.info('Added %d Animals. Updated %d Animals' % (added, updated))
+        graph = load_graph(session)
+        dirty = graph.descendant_closure(i for i in range(len(graph)) if graph.ids[i] in changed_ids)
+        dirty_ids = graph.ids_of(i for i in range(len(graph)) if dirty[i])
+    record_dirty_animals(engine, dirty_ids)
+    logging.info('Marked %d Animals dirty: %d changed Animals and their descendants' % (len(dirty_ids), len(changed_ids)))
+
+def record_dirty_animals(engine, dirty_ids):
+    ''' Replaces the dirty set with the given Animal ids '''
+    table = DirtyAnimal.__table__
+    table.create(engine, checkfirst=True)
+    with engine.begin() as connection:
+        connection.execute(table.delete())
+        for animal_ids in chunked(dirty_ids, 10000):
+            connection.execute(table.insert(), [{'id': animal_id} for animal_id in animal_ids])
+
+def dirty_ids_query(engine):
+    ''' Returns a select of the ids in the dirty set recorded by the last import '''
+    DirtyAnimal.__table__.create(engine, checkfirst=True)
+    return select([DirtyAnimal.id])
+
+def load_dirty_ids(engine):
+    ''' Returns the dirty set recorded by the last import as a set of Animal ids '''
+    dirty_ids = set(row[0] for row in engine.execute(dirty_ids_query(engine)))
+    logging.info('Restricting to %d dirty Animals' % len(dirty_ids))
+    return dirty_ids
 
 def fix_misgenders(settings_file):
     ''' Connects to the database and corrects the gender values for all animals '''
@@ -97,26 +393,26 @@ def fix_misgenders(settings_file):
     settings, engine, session_class = init(settings_file)
     gender_map = settings.get('gender_map', {})
     with closing(session_class()) as session:
-        parent = aliased(Animal)
-        child = aliased(Animal)
-        male_females = [a[0] for a in session.query(child.dam_id)\
-                                             .outerjoin(parent, parent.id == child.dam_id)\
-                                             .filter(parent.sex == gender_map['MALE'])\
-                                             .group_by(child.dam_id)\
-                                             .all()]
-        female_males = [a[0] for a in session.query(child.sire_id)\
-                                             .outerjoin(parent, parent.id == child.sire_id)\
-                                             .filter(parent.sex == gender_map['FEMALE'])\
-                                             .group_by(child.sire_id)\
-                                             .all()]
+        is_male_female = (Animal.sex == gender_map['MALE']) & Animal.id.in_(session.query(Animal.dam_id).filter(Animal.dam_id != None))
+        is_female_male = (Animal.sex == gender_map['FEMALE']) & Animal.id.in_(session.query(Animal.sire_id).filter(Animal.sire_id != None))
+        male_females = [a[0] for a in session.query(Animal.id).filter(is_male_female).order_by(Animal.id)]
+        female_males = [a[0] for a in session.query(Animal.id).filter(is_female_male).order_by(Animal.id)]
         logging.info('Detected misassigned %d Males and misassigned %d Females' % (len(male_females), len(female_males)))
-        logging.info('Male Females: %s' % ','.join([str(aid) for aid in male_females]))
-        logging.info('Female Males: %s' % ','.join([str(aid) for aid in female_males]))
-        for animal_id in male_females:
-            session.query(Animal).filter(Animal.id == animal_id).update({'sex': gender_map['FEMALE']})
-        for animal_id in female_males:
-            session.query(Animal).filter(Animal.id == animal_id).update({'sex': gender_map['MALE']})
+        log_ids('Male Females', male_females)
+        log_ids('Female Males', female_males)
+        # A single UPDATE swaps both directions, evaluating every condition against the pre-update sex values
+        updated = session.query(Animal)\
+                         .filter(is_male_female | is_female_male)\
+                         .update({'sex': case([(Animal.sex == gender_map['MALE'], gender_map['FEMALE'])], else_=gender_map['MALE'])},
+                                 synchronize_session=False)
         session.commit()
+    if updated:
+        invalidate_graph(engine)
+
+def invalid_sex(gender_map):
+    ''' Returns the clause matching Animals whose sex is not a gender_map value. NULL counts as invalid, as it does in
+    validate, where SQL's NOT IN alone would let it through '''
+    return (Animal.sex == None) | not_(Animal.sex.in_(gender_map.values()))
 
 def fix_invalid_genders(settings_file):
     logging.info('Performing Invalid Gender Fix')
@@ -124,163 +420,433 @@ def fix_invalid_genders(settings_file):
     gender_map = settings.get('gender_map', {})
     with closing(session_class()) as session:
         gender, gender_value = gender_map.items()[0]
-        invalid_genders = session.query(Animal).filter(not_(Animal.sex.in_(gender_map.values())))
+        invalid_genders = session.query(Animal).filter(invalid_sex(gender_map))
         logging.info('Detected %d Animals with Invalid Gender Values. Resetting to %s' % (invalid_genders.count(), gender))
-        invalid_genders.update({'sex': gender_value}, synchronize_session='fetch')
+        updated = invalid_genders.update({'sex': gender_value}, synchronize_session='fetch')
         session.commit()
+    if updated:
+        invalidate_graph(engine)
 
 def generate_birth_date(animal_id):
     animal_id_str = str(animal_id)
     return 1900 + (int(animal_id_str[:3]) if animal_id_str[0] == '1' else int(animal_id_str[:2]))
 
-def fix_birth_dates(settings_file):
+def fix_birth_dates(settings_file, dirty_only=False):
     logging.info('Performing Birth Date Fix')
     settings, engine, session_class = init(settings_file)
     with closing(session_class()) as session:
-        birth_dates = session.query(Animal.id).filter(Animal.birth_date == None)
-        logging.info('Detected %d NULL birth dates' % birth_dates.count())
-        counter = 0
-        for animal_id in [animal.id for animal in birth_dates]:
+        query = session.query(Animal.id).filter(Animal.birth_date == None)
+        if dirty_only:
+            query = query.filter(Animal.id.in_(dirty_ids_query(engine)))
+        animal_ids = [a[0] for a in query]
+        logging.info('Detected %d NULL birth dates' % len(animal_ids))
+        corrections = []
+        uncorrected_ids = []
+        for animal_id in animal_ids:
             year = generate_birth_date(animal_id)
             if year >= 1979:
-                session.query(Animal).filter(Animal.id == animal_id).update({'birth_date': datetime.date(year, 1, 1)})
-                counter += 1
+                corrections.append({'_id': animal_id, 'birth_date': datetime.date(year, 1, 1)})
+            else:
+                uncorrected_ids.append(animal_id)
+        if corrections:
+            session.execute(Animal.__table__.update().where(Animal.id == bindparam('_id')), corrections)
         session.commit()
-        logging.info('Corrected %d NULL birth dates' % counter)
-        if birth_dates.count() > 0:
-            logging.info('Unable to correct birth dates for the following animals: %s' % ','.join([str(a[0]) for a in birth_dates]))
+        logging.info('Corrected %d NULL birth dates' % len(corrections))
+        if uncorrected_ids:
+            log_ids('Unable to correct birth dates for the following animals', uncorrected_ids)
+    if corrections:
+        invalidate_graph(engine)
 
-def generate_dummy_animals(settings_file):
+def generate_dummy_animals(settings_file, dirty_only=False):
     ''' Connects to the database and generates dummy parents for all animals whose parents do not exist '''
     logging.info('Performing Dummy Animal Generation')
     settings, engine, session_class = init(settings_file)
     gender_map = settings.get('gender_map', {})
     with closing(session_class()) as session:
-        parent = aliased(Animal)
-        child = aliased(Animal)
+        children = load_dirty_ids(engine) if dirty_only else None
+        sire_ids, dam_ids = load_graph(session, settings.get('snapshot_directory')).missing_parents(children)
         sires = 0
         dams = 0
-        for sire_id in [a[0] for a in session.query(distinct(child.sire_id))\
-                             .outerjoin(parent, child.sire_id == parent.id)\
-                             .filter((child.sire_id != None) & (parent.id == None))]:
+        for sire_id in sire_ids:
             session.add(Animal(id = sire_id, sex=gender_map['MALE'], birth_date=datetime.date(generate_birth_date(sire_id), 1, 1), dummy_animal=True))
             sires += 1
-        for dam_id in [a[0] for a in session.query(distinct(child.dam_id))\
-                             .outerjoin(parent, child.dam_id == parent.id)\
-                             .filter((child.dam_id != None) & (parent.id == None))]:
+        # An id referenced both as a sire and as a dam only gets the dummy sire
+        for dam_id in sorted(set(dam_ids).difference(sire_ids)):
             session.add(Animal(id = dam_id, sex=gender_map['FEMALE'], birth_date=datetime.date(generate_birth_date(dam_id),1,1), dummy_animal=True))
             dams +=1
         session.commit()
         logging.info('Added %d Dummy Sires and %s Dummy Dams' % (sires, dams))
+    if sires or dams:
+        invalidate_graph(engine)
 
-def set_base_population_members(settings_file, method='standard'):
+def set_base_population_members(settings_file, method='standard', dirty_only=False):
     ''' Connects to the database and updates the base_population_member for all animals based on algorithm'''
     logging.info('Performing Base Population Marking using %s Method' % method.capitalize())
     settings, engine, session_class = init(settings_file)
     with closing(session_class()) as session:
+        candidates = Animal.id.in_(dirty_ids_query(engine)) if dirty_only else true()
+        base_member_count = 0
         if method == 'standard':
-            base_members_query = session.query(Animal).filter( (Animal.base_population_member == False) & (Animal.group.in_([0,1]) & (Animal.birth_date < datetime.date(2003,1,1)) ) )
+            base_members_query = session.query(Animal).filter( (Animal.base_population_member == False) & (Animal.group.in_([0,1]) & (Animal.birth_date < datetime.date(2003,1,1)) ) & candidates )
             logging.info('Detected %d Base Population Members (Animals with Group value equal to either 0 or 1 born before 01/01/2003)' % base_members_query.count())
-            base_members_query.update({'sire_id': None, 'dam_id': None, 'base_population_member': True}, synchronize_session='fetch')
+            base_member_count = base_members_query.update({'sire_id': None, 'dam_id': None, 'base_population_member': True}, synchronize_session='fetch')
         elif method == 'noparents':
             sire = aliased(Animal)
             dam = aliased(Animal)
-            child = aliased(Animal)
-            base_member_ids = [a[0] for a in session.query(distinct(child.id))\
-                                                  .outerjoin(sire, child.sire_id == sire.id)\
-                                                  .outerjoin(dam, child.dam_id == dam.id)\
-                                                  .filter((Animal.base_population_member == False) & (sire.id == None) & (dam.id == None))]
-            logging.info('Detected %d possible Base Population Members' % len(base_member_ids))
-            for base_member_id in base_member_ids:
-                session.query(Animal)\
-                       .filter(Animal.id == base_member_id)\
-                       .update({'sire_id': None, 'dam_id': None, 'base_population_member': True, 'notes': "Added as Base Population Member due to Parents Not Existing in Database"})
+            base_member_count = session.query(Animal)\
+                                       .filter((Animal.base_population_member == False) &
+                                               ~exists().where(sire.id == Animal.sire_id) &
+                                               ~exists().where(dam.id == Animal.dam_id) &
+                                               candidates)\
+                                       .update({'sire_id': None, 'dam_id': None, 'base_population_member': True, 'notes': "Added as Base Population Member due to Parents Not Existing in Database"},
+                                               synchronize_session=False)
+            logging.info('Detected %d possible Base Population Members' % base_member_count)
         session.commit()
+    if base_member_count:
+        invalidate_graph(engine)
 
-def locate_disconnected_animals(settings_file, input_file=None, delete=False):
-    ''' Connects to the database and locates all animals that are disconnected from the dataset '''
+def locate_disconnected_animals(settings_file, input_file=None, delete=False, min_component_size=None):
+    ''' Connects to the database, splits the pedigree into connected components and locates all animals in components
+    smaller than min_component_size. The default of 2 locates animals disconnected from the rest of the dataset. Each
+    located component is listed with its members under the id of its root Animal '''
     logging.info('Performing Disconnected Animal Detection')
     if input_file:
         logging.info('Will filter Animal IDs using data from %s' % input_file)
     if delete:
         logging.info('Will delete located Animals')
     settings, engine, session_class = init(settings_file)
+    if min_component_size is None:
+        min_component_size = settings.get('min_component_size', 2)
     with closing(session_class()) as session:
-        sire = aliased(Animal)
-        dam = aliased(Animal)
-        child1 = aliased(Animal)
-        child2 = aliased(Animal)
-        disconnected_animals = session.query(Animal)\
-                                      .outerjoin(sire, Animal.sire_id == sire.id)\
-                                      .outerjoin(dam, Animal.dam_id == dam.id)\
-                                      .outerjoin(child1, Animal.id == child1.sire_id)\
-                                      .outerjoin(child2, Animal.id == child2.dam_id)\
-                                      .filter( (sire.id == None) & (dam.id == None) & (child1.id == None) & (child2.id == None) )
-        if input_file:
-            disconnected_animals = disconnected_animals.filter(Animal.id.in_(load_csv(settings, input_file).keys()))
-        logging.info('Detected %d total disconnected Animals' % disconnected_animals.count())
-        logging.info('Disconnected Animal IDs: %s' % ','.join([str(animal.id) for animal in disconnected_animals]))
+        graph = load_graph(session, settings.get('snapshot_directory'))
+        roots, sizes = graph.components()
+        component_sizes = [sizes[i] for i in range(len(graph)) if roots[i] == i]
+        logging.info('Detected %d connected components, the largest containing %d Animals' %
+                     (len(component_sizes), max(component_sizes) if component_sizes else 0))
+        size_counts = {}
+        for size in component_sizes:
+            size_counts[size] = size_counts.get(size, 0) + 1
+        logging.info('Components by size: %s' % ', '.join(['%d x %d' % (size_counts[size], size) for size in sorted(size_counts)]))
+        logging.info('Flagging components smaller than %d Animals' % min_component_size)
+        members = {}
+        for i in range(len(graph)):
+            if sizes[roots[i]] < min_component_size:
+                members.setdefault(roots[i], []).append(i)
+        input_ids = set(load_csv(settings, input_file).keys()) if input_file else None
+        disconnected_animal_ids = []
+        components = 0
+        # Every flagged component is listed under its root Animal id, so its size is its id count in the run report
+        for root in sorted(members, key=lambda root: (-sizes[root], graph.ids[root])):
+            component_ids = [animal_id for animal_id in graph.ids_of(members[root]) if input_ids is None or animal_id in input_ids]
+            if component_ids:
+                log_ids('Disconnected component %d' % graph.ids[root], component_ids)
+                disconnected_animal_ids.extend(component_ids)
+                components += 1
+        logging.info('Detected %d total disconnected Animals in %d components' % (len(disconnected_animal_ids), components))
+        log_ids('Disconnected Animal IDs', disconnected_animal_ids)
+        deleted = 0
         if delete:
             logging.info('Deleting disconnected Animals')
-            for animal in disconnected_animals:
-                session.delete(animal)
+            for animal_ids in chunked(disconnected_animal_ids, max_bind_parameters(engine.dialect)):
+                deleted += session.query(Animal).filter(Animal.id.in_(animal_ids)).delete(synchronize_session=False)
         session.commit()
+    if deleted:
+        invalidate_graph(engine)
+
+def write_validation_report(problems, animal_count, output_file):
+    ''' Writes validation problems as JSON, or as check,id rows when output_file ends in .csv '''
+    if output_file.lower().endswith('.csv'):
+        with open(output_file, 'wb') as output:
+            writer = csv.writer(output)
+            writer.writerow(['check', 'id'])
+            for name in sorted(problems):
+                writer.writerows([name, animal_id] for animal_id in problems[name])
+    else:
+        report = {'animals': animal_count,
+                  'checks': dict((name, {'count': len(ids), 'ids': ids}) for name, ids in problems.items())}
+        with open(output_file, 'w') as output:
+            json.dump(report, output, sort_keys=True)
 
-def get_rows_for_generate(session_class, groups = None):
+def validate(settings_file, output_file=None, fix=False):
+    ''' Connects to the database and checks every Animal in a single pass over the pedigree for sex conflicts, invalid
+    sexes, missing parents, birth date ordering and self or duplicate parent references. Optionally applies every
+    correction in one bulk transaction '''
+    logging.info('Performing Pedigree Validation')
+    settings, engine, session_class = init(settings_file)
+    gender_map = settings.get('gender_map', {})
     with closing(session_class()) as session:
-        query = session.query(Animal)
-        # Allow for Group Tuning
-        if isinstance(groups, list):
-            query = query.filter( (Animal.group.in_(groups)) | (Animal.base_population_member == True) )
-        row_sets = [ [animal for animal in query] ]
-        while True:
-            animals = row_sets[0]
-            animal_ids = [animal.id for animal in animals]
-            parent_ids = set([animal.sire_id for animal in animals] + [animal.dam_id for animal in animals])
-            missing_parent_ids = parent_ids.difference(animal_ids)
-            if not missing_parent_ids:
-                break
-            row_sets.insert(0, [animal for animal in session.query(Animal).filter(Animal.id.in_(missing_parent_ids))])
-        return { animal.id: animal for row_set in row_sets for animal in row_set }.values()
+        graph = load_graph(session, settings.get('snapshot_directory'))
+    gender, gender_value = gender_map.items()[0]
+    problems, corrections = graph.validate(gender_map['MALE'], gender_map['FEMALE'], set(gender_map.values()), gender_value)
+    for name in sorted(problems):
+        logging.info('Detected %d %s' % (len(problems[name]), name.replace('_', ' ')))
+    if output_file:
+        write_validation_report(problems, len(graph), output_file)
+        logging.info('Wrote Validation Report to %s' % output_file)
+    if fix:
+        table = Animal.__table__
+        update = table.update().where(table.c.id == bindparam('_id'))
+        with engine.begin() as connection:
+            parent_rows = [{'_id': graph.ids[i], 'sire_id': sire_id, 'dam_id': dam_id}
+                           for i, (sire_id, dam_id) in corrections['parents'].items()]
+            if parent_rows:
+                connection.execute(update, parent_rows)
+            sex_rows = [{'_id': graph.ids[i], 'sex': sex} for i, sex in corrections['sexes'].items()]
+            if sex_rows:
+                connection.execute(update, sex_rows)
+            dummy_rows = [with_insert_defaults(dict([(column.name, None) for column in table.columns] +
+                                                    [('id', parent_id), ('sex', sex), ('dummy_animal', True),
+                                                     ('birth_date', datetime.date(generate_birth_date(parent_id), 1, 1))]))
+                          for parent_ids, sex in ((corrections['dummy_sires'], gender_map['MALE']),
+                                                  (corrections['dummy_dams'], gender_map['FEMALE']))
+                          for parent_id in parent_ids]
+            if dummy_rows:
+                connection.execute(table.insert(), dummy_rows)
+        logging.info('Repaired parents of %d Animals, corrected %d sexes and added %d Dummy Animals' %
+                     (len(parent_rows), len(sex_rows), len(dummy_rows)))
+        if parent_rows or sex_rows or dummy_rows:
+            invalidate_graph(engine)
+
+def get_rows_for_generate(session, groups=None, snapshot_directory=None):
+    ''' Returns rows for the selected Animals and all of their ancestors, ordered ancestors-first with descendants
+    always following their parents. Ordering needs the whole pedigree, so rows come from the PedigreeGraph held in
+    memory (roughly 70 bytes per Animal) rather than streaming from a database cursor '''
+    return ordered_rows(load_graph(session, snapshot_directory), groups)
+
+def ordered_rows(graph, groups=None):
+    ''' Returns rows of the graph for the selected Animals and all of their ancestors, ordered ancestors-first. Animals
+    of the selection on parentage cycles are logged and left out, and the parent references to them are written as
+    unknown, while cycles outside the selection are ignored '''
+    order, generations, cycles = graph.order_excluding_cycles()
+    selection = graph.selection(groups)
+    cycle_ids = graph.ids_of(i for i in cycles if selection[i])
+    indexes = [i for i in order if selection[i]]
+    left_out = None
+    if cycle_ids:
+        logging.warning('Leaving out %d Animals on parentage cycles' % len(cycle_ids))
+        log_ids('Parentage cycle Animal IDs', cycle_ids)
+        left_out = bytearray(len(selection))
+        for i in cycles:
+            left_out[i] = 1
+        logging.warning('Cut %d parent references to Animals on parentage cycles' % graph.parents_left_out(indexes, left_out))
+    logging.info('Ordered %d Animals across %d Generations' % (len(indexes), max(generations[i] for i in indexes) + 1 if indexes else 0))
+    return graph.rows(indexes, left_out)
+
+def format_popreport_line(animal):
+    ''' Formats a row for generate as a single PopReport input line '''
+    return '%s|%s|%s|%s|%s' % (animal.id if animal.id is not None else '',
+                               animal.sire_id if animal.sire_id is not None else '',
+                               animal.dam_id if animal.dam_id is not None else '',
+                               animal.birth_date.isoformat() if animal.birth_date is not None else '',
+                               animal.sex if animal.sex is not None else '')
+
+def write_popreport_file(animals, output_file, buffer_size=1 << 20):
+    ''' Streams rows for generate into a PopReport input file through a buffered writer. Returns the number of rows written '''
+    count = 0
+    with open(output_file, 'w', buffer_size) as output:
+        for animal in animals:
+            if count:
+                output.write('\n')
+            output.write(format_popreport_line(animal))
+            count += 1
+    return count
+
+def write_endog_file(animals, output_file):
+    ''' Streams rows for generate into an Endog DBF input file. Returns the number of rows written '''
+    writer = EndogDbfWriter(output_file)
+    try:
+        for animal in animals:
+            writer.write(animal.id, animal.sire_id, animal.dam_id, animal.birth_date, animal.sex, animal.group,
+                         int(animal.base_population_member))
+    finally:
+        writer.close()
+    return writer.count
 
 def generate_popreport_input(settings_file, output_file, groups=None):
     ''' Connects to the database and dumps the data into a file formatted for PopReport '''
     logging.info('Generating PopReport Input File')
     settings, engine, session_class = init(settings_file)
-    with open(output_file, 'w') as output:
-        lines = []
-        for animal in get_rows_for_generate(session_class, groups):
-            lines.append('|'.join([str(c) for c in [animal.id if animal.id is not None else '',
-                                                    animal.sire_id if animal.sire_id is not None else '',
-                                                    animal.dam_id if animal.dam_id is not None else '',
-                                                    animal.birth_date.strftime('%Y-%m-%d') if animal.birth_date is not None else '',
-                                                    animal.sex if animal.sex is not None else '']]))
-        output.write('\n'.join(lines))
-        logging.info('Wrote %d Animals to %s' % (len(lines), output_file))
+    with closing(session_class()) as session:
+        count = write_popreport_file(get_rows_for_generate(session, groups, settings.get('snapshot_directory')), output_file)
+    logging.info('Wrote %d Animals to %s' % (count, output_file))
 
 def generate_endog_input(settings_file, output_file, groups=None):
     ''' Connects to the database and dumps the data into a file formatted for EndDog '''
     logging.info('Generating Endog Input File')
     settings, engine, session_class = init(settings_file)
-    with closing(dbf.Dbf(output_file, new=True)) as db:
-        db.addField(
-            ('ID', 'N', 16, 0),
-            ('SIRE_ID', 'N', 16, 0),
-            ('DAM_ID', 'N', 16, 0),
-            ('BIRTH_DATE', 'D'),
-            ('S', 'N', 1, 0),
-            ('GROUP','N', 16, 0),
-            ('REFERENCE', 'N', 1, 0)
-            )
-        animals = get_rows_for_generate(session_class, groups)
-        for animal in animals:
-            record = db.newRecord()
-            record['ID'] = animal.id if animal.id else 0
-            record['SIRE_ID'] = animal.sire_id if animal.sire_id else 0
-            record['DAM_ID'] = animal.dam_id if animal.dam_id else 0
-            record['BIRTH_DATE'] = animal.birth_date
-            record['S'] = animal.sex
-            record['GROUP'] = animal.group
-            record['REFERENCE'] = int(animal.base_population_member)
-            record.store()
-        logging.info('Wrote %d Animals to %s' % (len(animals), output_file))
+    with closing(session_class()) as session:
+        count = write_endog_file(get_rows_for_generate(session, groups, settings.get('snapshot_directory')), output_file)
+    logging.info('Wrote %d Animals to %s' % (count, output_file))
+
+# Writers used by batch_export, keyed by export format
+EXPORT_WRITERS = {
+    'popreport': write_popreport_file,
+    'endog': write_endog_file,
+}
+# PedigreeGraph shared with the batch_export workers, set by the pool initializer
+export_graph = None
+
+def set_export_graph(graph):
+    global export_graph
+    export_graph = graph
+
+def write_export_target(target):
+    ''' Writes a single (format, groups, output_file) target from the shared graph. Returns the number of rows written '''
+    format, groups, output_file = target
+    return EXPORT_WRITERS[format](ordered_rows(export_graph, groups), output_file)
+
+def write_export_target_in_worker(target):
+    ''' Writes a target in a pool worker, returning (rows written, worker run report) '''
+    return run_in_worker(write_export_target, target)
+
+def batch_export(settings_file, targets=None, workers=None):
+    ''' Connects to the database, reads the pedigree once and writes a list of (format, groups, output_file) targets on a
+    process pool. Targets are taken from the export_targets setting when not given '''
+    logging.info('Performing Batch Export')
+    settings, engine, session_class = init(settings_file)
+    targets = [(format.lower(), groups, output_file)
+               for format, groups, output_file in (targets if targets is not None else settings.get('export_targets', []))]
+    unknown_formats = sorted(set(format for format, groups, output_file in targets if format not in EXPORT_WRITERS))
+    if unknown_formats:
+        raise ValueError('Unknown export formats: %s' % ', '.join(unknown_formats))
+    # Workers writing the same file would clobber each other's output
+    paths = [os.path.realpath(output_file) for format, groups, output_file in targets]
+    duplicate_paths = sorted(set(path for path in paths if paths.count(path) > 1))
+    if duplicate_paths:
+        raise ValueError('Export targets share output files: %s' % ', '.join(duplicate_paths))
+    with closing(session_class()) as session:
+        graph = load_graph(session, settings.get('snapshot_directory'))
+    # Ordering once up front lets every worker share the memoized order
+    graph.order_excluding_cycles()
+    workers = min(len(targets), workers or settings.get('export_workers') or multiprocessing.cpu_count())
+    logging.info('Writing %d Export Targets with %d Workers' % (len(targets), workers))
+    with phase('write_targets'):
+        if workers > 1:
+            # Where multiprocessing forks, as on Linux, workers inherit the graph as initializer arguments without
+            # pickling it. On Windows it is pickled to every worker instead
+            pool = multiprocessing.Pool(workers, set_export_graph, (graph,))
+            try:
+                results = pool.map(write_export_target_in_worker, targets, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+            # Statements, rows and ids counted in the workers are added to this process's run report
+            counts = []
+            for count, report in results:
+                merge_worker(report)
+                counts.append(count)
+        else:
+            set_export_graph(graph)
+            counts = [write_export_target(target) for target in targets]
+    for (format, groups, output_file), count in zip(targets, counts):
+        logging.info('Wrote %d Animals to %s' % (count, output_file))
+
+def compute_inbreeding(settings_file, groups=None, dirty_only=False):
+    ''' Connects to the database, computes inbreeding coefficients in-process and writes them back in bulk. With
+    dirty_only, only the dirty Animals are written, computed over them and their ancestors '''
+    from inbreeding import inbreeding_coefficients
+    logging.info('Performing Inbreeding Computation')
+    settings, engine, session_class = init(settings_file)
+    with closing(session_class()) as session:
+        graph = load_graph(session, settings.get('snapshot_directory'))
+        selection = graph.selection(groups)
+        written = selection
+        if dirty_only:
+            dirty_ids = load_dirty_ids(engine)
+            written = bytearray(1 if selection[i] and graph.ids[i] in dirty_ids else 0 for i in range(len(graph)))
+            selection = graph.ancestor_closure(i for i in range(len(graph)) if written[i])
+        order, generations = graph.topological_order()
+        order = [i for i in order if selection[i]]
+        with phase('inbreeding_coefficients'):
+            coefficients = inbreeding_coefficients(order, graph.sires, graph.dams, generations)
+        logging.info('Computed inbreeding coefficients for %d Animals. %d are inbred, mean F = %.6f' %
+                     (len(order), (coefficients > 0).sum(), coefficients.mean() if len(order) else 0.0))
+        statement = Animal.__table__.update().where(Animal.id == bindparam('_id'))
+        results = ((animal_id, coefficient) for i, animal_id, coefficient in zip(order, graph.ids_of(order), coefficients.tolist()) if written[i])
+        for rows in chunked(results, 10000):
+            session.execute(statement, [{'_id': animal_id, 'inbreeding': coefficient} for animal_id, coefficient in rows])
+        session.commit()
+
+def compute_completeness(settings_file, output_file=None, depth=None):
+    ''' Connects to the database, computes pedigree completeness and generation depth for every Animal in-process and
+    summarizes them per group and birth year, treating dummy parents as unknown '''
+    import numpy
+    from completeness import pedigree_completeness
+    logging.info('Performing Pedigree Completeness Computation')
+    settings, engine, session_class = init(settings_file)
+    depth = depth or settings.get('completeness_generations', 5)
+    with closing(session_class()) as session:
+        graph = load_graph(session, settings.get('snapshot_directory'))
+    order, generations = graph.topological_order()
+    real = (numpy.frombuffer(graph.flags, dtype=numpy.int8) & DUMMY_ANIMAL) == 0
+    results = pedigree_completeness(graph.sires, graph.dams, generations, real, depth)
+    measures = ['pci', 'maximum_generations', 'complete_generations', 'equivalent_generations']
+    logging.info('Computed pedigree completeness over %d generations for %d Animals, excluding %d Dummy Animals' %
+                 (depth, real.sum(), len(graph) - real.sum()))
+    if real.any():
+        logging.info('Mean PCI %.4f, maximum generations %.2f, complete generations %.2f, equivalent generations %.2f' %
+                     tuple(results[measure][real].mean() for measure in measures))
+    # Summarize per (group, birth year) cell with bincount over combined codes
+    groups = numpy.frombuffer(graph.groups, dtype=numpy.int32)[real]
+    ordinals, ordinal_codes = numpy.unique(numpy.frombuffer(graph.birth_dates, dtype=numpy.int32)[real], return_inverse=True)
+    years = numpy.array([datetime.date.fromordinal(ordinal).year if ordinal else 0 for ordinal in ordinals], dtype=numpy.int32)[ordinal_codes]
+    group_values, group_codes = numpy.unique(groups, return_inverse=True)
+    year_values, year_codes = numpy.unique(years, return_inverse=True)
+    cells, cell_codes = numpy.unique(group_codes * len(year_values) + year_codes, return_inverse=True)
+    counts = numpy.bincount(cell_codes)
+    means = [numpy.bincount(cell_codes, weights=results[measure][real]) / counts for measure in measures]
+    logging.info('Summarized %d group and birth year combinations' % len(cells))
+    if output_file:
+        with open(output_file, 'wb') as output:
+            writer = csv.writer(output)
+            writer.writerow(['group', 'birth_year', 'animals'] + ['mean_%s' % measure for measure in measures])
+            for cell, cell_count, cell_means in zip(cells, counts, zip(*means)):
+                group = group_values[cell // len(year_values)]
+                year = year_values[cell % len(year_values)]
+                writer.writerow(['' if group == NULL_VALUE else group, year or '', cell_count] + ['%.6f' % mean for mean in cell_means])
+        logging.info('Wrote Completeness Summary to %s' % output_file)
+
+def snapshot(settings_file, output_directory=None):
+    ''' Connects to the database and writes the pedigree graph and its ordering as memory-mappable columnar .npy files,
+    stamped with the table version so later runs only map it while the animals table is unchanged '''
+    from snapshots import write_snapshot
+    logging.info('Performing Snapshot')
+    settings, engine, session_class = init(settings_file)
+    output_directory = output_directory or settings.get('snapshot_directory')
+    if not output_directory:
+        raise ValueError('snapshot needs an output directory or the snapshot_directory setting')
+    table_version = get_table_version(engine)
+    with closing(session_class()) as session:
+        graph = load_graph(session)
+    try:
+        ordering = graph.topological_order()
+    except ValueError as error:
+        logging.warning('Writing snapshot without an ordering: %s' % error)
+        ordering = None
+    write_snapshot(graph, output_directory, table_version, ordering)
+    logging.info('Wrote Snapshot of %d Animals at table version %d to %s' % (len(graph), table_version, output_directory))
+
+# Modes that can be run as pipeline steps, in the order they are normally run
+PIPELINE_STEPS = ['init_database', 'import_csv', 'validate', 'fix_misgenders', 'fix_invalid_genders', 'fix_birth_dates',
+                  'generate_dummy_animals', 'set_base_population_members', 'locate_disconnected_animals', 'snapshot',
+                  'compute_inbreeding', 'compute_completeness', 'generate_popreport_input', 'generate_endog_input', 'batch_export']
+
+def pipeline(settings_file, steps=None):
+    ''' Runs an ordered list of modes in one process sharing the engine, connection pool and cached PedigreeGraph.
+
+    Steps are mode names or (mode, kwargs) pairs, taken from the pipeline_steps setting when not given. Every step
+    commits its own transaction and the pipeline stops at the first step that fails. '''
+    settings, engine, session_class = init(settings_file)
+    steps = [step if isinstance(step, (tuple, list)) else (step, {}) for step in (steps if steps is not None else settings.get('pipeline_steps', []))]
+    unknown_steps = [mode for mode, kwargs in steps if mode not in PIPELINE_STEPS]
+    if unknown_steps:
+        raise ValueError('Unknown pipeline steps: %s' % ', '.join(unknown_steps))
+    logging.info('Performing Pipeline of %d Steps' % len(steps))
+    for number, (mode, kwargs) in enumerate(steps, 1):
+        logging.info('Pipeline Step %d of %d: %s' % (number, len(steps), mode))
+        try:
+            with phase(mode):
+                globals()[mode](settings_file, **dict(kwargs))
+        except Exception:
+            logging.exception('Pipeline stopped at step %d (%s)' % (number, mode))
+            raise
@@ -0,0 +1,81 @@
+import json
+import os
+from array import array
+import numpy
+from graph import PedigreeGraph
+
+__author__ = 'adamj'
+
+SNAPSHOT_FORMAT = 1
+MANIFEST_FILE = 'manifest.json'
+# (attribute, typecode) of every column in a snapshot, using the PedigreeGraph array typecodes as numpy dtypes
+COLUMNS = (
+    ('ids', 'l'),
+    ('sire_ids', 'l'),
+    ('dam_ids', 'l'),
+    ('sexes', 'i'),
+    ('groups', 'i'),
+    ('birth_dates', 'i'),
+    ('flags', 'b'),
+    ('sires', 'i'),
+    ('dams', 'i'),
+    ('child_offsets', 'i'),
+    ('children', 'i'),
+)
+ORDERING_COLUMNS = (
+    ('order', 'i'),
+    ('generations', 'i'),
+)
+
+def write_snapshot(graph, directory, table_version, ordering=None):
+    ''' Writes the graph arrays as one .npy file per column plus a manifest stamped with the table version. The manifest
+    is written last and replaced atomically, so readers never see a partially written snapshot '''
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    columns = [(name, typecode, getattr(graph, name)) for name, typecode in COLUMNS]
+    if ordering is not None:
+        columns.extend((name, typecode, values) for (name, typecode), values in zip(ORDERING_COLUMNS, ordering))
+    for name, typecode, values in columns:
+        if isinstance(values, array):
+            values = numpy.frombuffer(values, dtype=typecode)
+        numpy.save(os.path.join(directory, '%s.npy' % name), numpy.asarray(values, dtype=typecode))
+    manifest = {'format': SNAPSHOT_FORMAT,
+                'table_version': table_version,
+                'animals': len(graph),
+                'columns': [column[0] for column in columns]}
+    with open(manifest_path + '.tmp', 'w') as output:
+        json.dump(manifest, output, sort_keys=True)
+    os.rename(manifest_path + '.tmp', manifest_path)
+
+def read_manifest(directory):
+    ''' Returns the manifest of the snapshot in directory, or None if there is no complete snapshot '''
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE)) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (IOError, ValueError):
+        return None
+    return manifest if manifest.get('format') == SNAPSHOT_FORMAT else None
+
+def read_column(directory, name, typecode):
+    ''' Memory-maps a column file and copies it into an array in one block, as PedigreeGraph's per-element loops run
+    several times slower over numpy scalars than over array items '''
+    mapped = numpy.load(os.path.join(directory, '%s.npy' % name), mmap_mode='r')
+    if mapped.dtype != numpy.dtype(typecode):
+        mapped = mapped.astype(typecode)
+    values = array(typecode)
+    values.fromstring(buffer(mapped))
+    return values
+
+def read_snapshot(directory, table_version):
+    ''' Returns a PedigreeGraph loaded from the snapshot in directory, or None when the snapshot is missing or was taken
+    from a different table version '''
+    manifest = read_manifest(directory)
+    if manifest is None or manifest['table_version'] != table_version:
+        return None
+    typecodes = dict(COLUMNS + ORDERING_COLUMNS)
+    arrays = dict((name, read_column(directory, name, typecodes[name])) for name in manifest['columns'])
+    ordering = (arrays['order'], arrays['generations']) if 'order' in arrays else None
+    return PedigreeGraph(*[arrays[name] for name, typecode in COLUMNS], ordering=ordering)